@@ -1 +1,6 @@
-from . import kanji_furi, sentence_examples
\ No newline at end of file
+import sys
+
+# Anki imports aqt and sets up mw before it loads any add-on, so only then is the add-on itself loaded.
+# Outside Anki, e.g. running compile_dicts on a build box, aqt and PyQt aren't imported even when installed.
+if getattr(sys.modules.get("aqt"), "mw", None) is not None:
+    from . import kanji_furi, sentence_examples
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+
+# Build artifacts (the SQLite stores and sentences.pickle) carry a header saying what built them and from
+# which source files, so a newer JMdict or Tatoeba export, or a change to the artifact format, gets noticed
+# and rebuilt instead of serving the old cache forever.
+
+# Bump when any builder starts producing different output from the same sources
+BUILDER_VERSION = 1
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_info(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime), "sha256": file_hash(path)}
+
+
+def make_header(kind, format_version, sources):
+    # sources maps a name to the path of each file the artifact was built from
+    return {"kind": kind, "format_version": format_version, "builder_version": BUILDER_VERSION,
+            "sources": {name: source_info(path) for name, path in sources.items()}}
+
+
+def sources_available(sources):
+    return all(os.path.isfile(path) for path in sources.values())
+
+
+def header_matches_format(header, kind, format_version):
+    return (isinstance(header, dict) and header.get("kind") == kind
+            and header.get("format_version") == format_version
+            and header.get("builder_version") == BUILDER_VERSION)
+
+
+def header_is_current(header, kind, format_version, sources):
+    if not header_matches_format(header, kind, format_version):
+        return False
+    recorded = header.get("sources", {})
+    if set(recorded) != set(sources):
+        return False
+    for name, path in sources.items():
+        if not os.path.isfile(path):
+            # Releases ship the artifacts without the sources, nothing to compare against
+            continue
+        stat = os.stat(path)
+        info = recorded[name]
+        if stat.st_size == info["size"] and int(stat.st_mtime) == info["mtime"]:
+            continue
+        # Size or mtime moved, only a different hash means the file really changed
+        if stat.st_size != info["size"] or file_hash(path) != info["sha256"]:
+            return False
+    return True
+
+
+def atomic_write(path, write):
+    # write(tmp_path) builds the whole artifact, only a finished file is swapped in so a crash or a
+    # concurrent reader never sees half of one. The tmp name is the writer's own, so two writers at once
+    # (e.g. a re-sort and a reload of the sentences) each swap in a whole file and the last one wins.
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        write(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def header_version(header):
+    # Short id for what an artifact was built from, for caches derived from it. None when there's no
+    # header to go on, e.g. an artifact from before headers existed.
+    if not isinstance(header, dict):
+        return None
+    content = {"kind": header.get("kind"), "format_version": header.get("format_version"),
+               "builder_version": header.get("builder_version"),
+               "sources": {name: info.get("sha256") for name, info in header.get("sources", {}).items()}}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()[:16]
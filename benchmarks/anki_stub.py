@@ -0,0 +1,206 @@
+import sys
+import types
+from concurrent.futures import Future
+
+# Just enough of aqt, anki and PyQt6 for kanji_furi to import and run its lookups outside Anki.
+# Dialogs and menus become inert objects, the collection is an in-memory list of notes.
+
+
+class Inert:
+    # Stands in for any Qt class or Anki helper that the benchmark never really uses
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return Inert()
+
+    def __getattr__(self, name):
+        return Inert()
+
+
+class InertModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Inert
+
+
+class Hooks:
+    def __getattr__(self, name):
+        hook = []
+        setattr(self, name, hook)
+        return hook
+
+
+class Note:
+    def __init__(self, note_type, values, note_id=0):
+        self.id = note_id
+        self.model = note_type
+        self.fields = dict(zip(note_type["fields"], values))
+
+    def note_type(self):
+        return self.model
+
+    def keys(self):
+        return list(self.fields)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+
+class Models:
+    def __init__(self, note_types):
+        self.note_types = note_types
+
+    def field_names(self, note_type):
+        return list(note_type["fields"])
+
+    def all_names(self):
+        return [note_type["name"] for note_type in self.note_types]
+
+    def by_name(self, name):
+        return next((note_type for note_type in self.note_types if note_type["name"] == name), None)
+
+    def all(self):
+        return list(self.note_types)
+
+
+class Media:
+    def strip(self, text):
+        return text
+
+
+class Database:
+    # Answers the handful of queries kanji_furi sends to the notes table
+    def __init__(self, collection):
+        self.collection = collection
+
+    def notes_of(self, model_id):
+        return [note for note in self.collection.notes.values() if note.model["id"] == model_id]
+
+    def list(self, sql, *args):
+        return [note.id for note in self.notes_of(args[0])]
+
+    def scalar(self, sql, *args):
+        return len(self.notes_of(args[0]))
+
+    def all(self, sql, *args):
+        return [(note.id, "\x1f".join(note.fields.values())) for note in self.notes_of(args[0])]
+
+
+class Collection:
+    def __init__(self, note_types, notes):
+        self.models = Models(note_types)
+        self.media = Media()
+        self.db = Database(self)
+        self.notes = {note.id: note for note in notes}
+        self.writes = 0
+
+    def get_note(self, note_id):
+        stored = self.notes[note_id]
+        return Note(stored.model, list(stored.fields.values()), note_id)
+
+    def update_notes(self, notes):
+        self.writes += 1
+        for note in notes:
+            self.notes[note.id] = note
+        return OpChanges()
+
+    def update_note(self, note):
+        return self.update_notes([note])
+
+
+class OpChanges:
+    pass
+
+
+class NoteOp:
+    # aqt.operations.note.update_note, run straight away
+    def __init__(self, mw, note):
+        self.mw = mw
+        self.note = note
+        self.on_success = None
+
+    def success(self, on_success):
+        self.on_success = on_success
+        return self
+
+    def run_in_background(self):
+        changes = self.mw.col.update_note(self.note)
+        if self.on_success is not None:
+            self.on_success(changes)
+
+
+class TaskManager:
+    # Runs "background" work straight away so timings include it
+    def run_in_background(self, task, on_done=None, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(task())
+        except Exception as e:
+            future.set_exception(e)
+        if on_done is not None:
+            on_done(future)
+        return future
+
+    def run_on_main(self, function):
+        function()
+
+
+class ProgressManager:
+    def want_cancel(self):
+        return False
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+class AddonManager:
+    def __init__(self, config):
+        self.config = config
+
+    def getConfig(self, name):
+        return self.config
+
+    def writeConfig(self, name, config):
+        self.config = config
+
+
+class MainWindow:
+    def __init__(self, config, collection):
+        self.addonManager = AddonManager(config)
+        self.col = collection
+        self.taskman = TaskManager()
+        self.progress = ProgressManager()
+        self.form = Inert()
+
+
+def install(config, collection):
+    # Must run before the add-on is imported
+    mw = MainWindow(config, collection)
+    for name in ["PyQt6", "PyQt6.QtCore", "PyQt6.QtGui", "PyQt6.QtWidgets", "aqt.qt"]:
+        sys.modules[name] = InertModule(name)
+    anki = types.ModuleType("anki")
+    anki_collection = types.ModuleType("anki.collection")
+    anki_collection.OpChanges = OpChanges
+    anki_notes = types.ModuleType("anki.notes")
+    anki_notes.Note = Note
+    aqt = InertModule("aqt")
+    aqt.mw = mw
+    aqt.gui_hooks = Hooks()
+    aqt.qconnect = lambda signal, slot: None
+    aqt_utils = InertModule("aqt.utils")
+    aqt_utils.tooltip = lambda *args, **kwargs: None
+    aqt_utils.showInfo = lambda *args, **kwargs: None
+    aqt_operations_note = types.ModuleType("aqt.operations.note")
+    aqt_operations_note.update_note = lambda parent, note: NoteOp(mw, note)
+    sys.modules.update({"anki": anki, "anki.collection": anki_collection, "anki.notes": anki_notes,
+                        "aqt": aqt, "aqt.utils": aqt_utils, "aqt.operations": InertModule("aqt.operations"),
+                        "aqt.operations.note": aqt_operations_note})
+    return mw
@@ -0,0 +1,66 @@
+import argparse
+import gc
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import fixtures
+
+# Measures memory and pickle round trip time of the sentence library on a synthetic Tatoeba export.
+# Point --module-path at another checkout to compare against an older revision of sentence_examples.
+
+
+def run(module_path, sentence_count, rating_count):
+    # Imported as part of a package, for its relative imports, but without running the add-on's __init__
+    package = types.ModuleType("anki_furigana")
+    package.__path__ = [os.path.abspath(module_path)]
+    sys.modules["anki_furigana"] = package
+    sentence_examples = importlib.import_module("anki_furigana.sentence_examples")
+    results = {"module": os.path.abspath(sentence_examples.__file__), "sentences": sentence_count}
+    with tempfile.TemporaryDirectory() as tmp:
+        tsv = os.path.join(tmp, "sentences.tsv")
+        csv = os.path.join(tmp, "ratings.csv")
+        pickle_file = os.path.join(tmp, "sentences.pickle")
+        fixtures.write_sentences(tsv, fixtures.make_vocabulary(5000), sentence_count)
+        fixtures.write_ratings(csv, sentence_count, rating_count)
+
+        # tracemalloc slows parsing right down, so this only looks at memory
+        gc.collect()
+        tracemalloc.start()
+        lib = sentence_examples.JapaneseSentenceLib()
+        lib.load_sentences_from_file(tsv)
+        lib.load_sentence_rating_data(csv)
+        gc.collect()
+        results["sentence_memory_mb"] = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        lib.save_pickle_file(pickle_file)
+        results["pickle_save_seconds"] = time.perf_counter() - start
+        results["pickle_size_mb"] = os.path.getsize(pickle_file) / 1e6
+        del lib
+        gc.collect()
+
+        start = time.perf_counter()
+        lib = sentence_examples.JapaneseSentenceLib()
+        lib.load_pickle_file(pickle_file)
+        results["pickle_load_seconds"] = time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module-path", default=os.path.join(os.path.dirname(__file__), ".."))
+    parser.add_argument("--sentences", type=int, default=200000)
+    parser.add_argument("--ratings", type=int, default=300000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.module_path, args.sentences, args.ratings), indent=2))
+
+
+if __name__ == "__main__":
+    main()
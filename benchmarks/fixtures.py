@@ -0,0 +1,121 @@
+import json
+import os
+import random
+
+# Synthetic stand-ins for the dictionary downloads, shaped like the real files but sized on demand.
+# Everything is driven by a seed so two runs (or two commits) benchmark exactly the same data.
+
+KANJI = [chr(code) for code in range(0x4E00, 0x4E00 + 400)]
+HIRAGANA = [chr(code) for code in range(0x3042, 0x3093)]
+PARTICLES = ["は", "が", "を", "に", "で", "と", "も", "の", "へ", "から", "まで"]
+ENDINGS = ["です。", "ます。", "でした。", "だ。", "ません。", "ですか。"]
+POS_ENTITIES = {
+    "n": "noun (common) (futsuumeishi)",
+    "v5k": "Godan verb with 'ku' ending",
+    "v1": "Ichidan verb",
+    "vs": "noun or participle which takes the aux. verb suru",
+    "vt": "transitive verb",
+    "vi": "intransitive verb",
+    "adj-i": "adjective (keiyoushi)",
+    "adj-na": "adjectival nouns or quasi-adjectives (keiyodoshi)",
+    "exp": "expressions (phrases, clauses, etc.)",
+}
+
+
+def kana(rng, length):
+    return "".join(rng.choice(HIRAGANA) for _ in range(length))
+
+
+def make_vocabulary(count, seed=0):
+    # (keb or None for kana only entries, reb, per kanji readings)
+    rng = random.Random(seed)
+    seen = set()
+    vocabulary = []
+    while len(vocabulary) < count:
+        if rng.random() < 0.1:
+            reb = kana(rng, rng.randint(2, 5))
+            if reb in seen:
+                continue
+            seen.add(reb)
+            vocabulary.append((None, reb, []))
+            continue
+        kanji = [rng.choice(KANJI) for _ in range(rng.randint(1, 3))]
+        readings = [kana(rng, rng.randint(1, 2)) for _ in kanji]
+        okurigana = kana(rng, 1) if rng.random() < 0.2 else ""
+        keb = "".join(kanji) + okurigana
+        if keb in seen:
+            continue
+        seen.add(keb)
+        vocabulary.append((keb, "".join(readings) + okurigana, list(zip(kanji, readings)) + (
+            [(okurigana, None)] if okurigana else [])))
+    return vocabulary
+
+
+def write_jmdict(path, vocabulary, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE JMdict [\n<!ELEMENT JMdict (entry*)>\n')
+        for name, value in POS_ENTITIES.items():
+            file.write(f'<!ENTITY {name} "{value}">\n')
+        file.write(']>\n<JMdict>\n')
+        for seq, (keb, reb, _) in enumerate(vocabulary, start=1000000):
+            file.write(f'<entry>\n<ent_seq>{seq}</ent_seq>\n')
+            if keb is not None:
+                file.write(f'<k_ele>\n<keb>{keb}</keb>\n</k_ele>\n')
+            file.write(f'<r_ele>\n<reb>{reb}</reb>\n</r_ele>\n')
+            for sense in range(rng.randint(1, 6)):
+                file.write('<sense>\n')
+                for pos in rng.sample(list(POS_ENTITIES), rng.randint(1, 2)):
+                    file.write(f'<pos>&{pos};</pos>\n')
+                for gloss in range(rng.randint(1, 4)):
+                    file.write(f'<gloss>meaning {seq}-{sense}-{gloss}</gloss>\n')
+                file.write('</sense>\n')
+            file.write('</entry>\n')
+        file.write('</JMdict>\n')
+
+
+def write_furigana(path, vocabulary):
+    data = []
+    for keb, reb, segments in vocabulary:
+        if keb is None:
+            continue
+        furigana = [{"ruby": ruby, "rt": rt} if rt else {"ruby": ruby} for ruby, rt in segments]
+        data.append({"text": keb, "reading": reb, "furigana": furigana})
+    with open(path, 'w', encoding='utf-8-sig') as file:
+        json.dump(data, file, ensure_ascii=False)
+
+
+def write_sentences(path, vocabulary, count, seed=0):
+    rng = random.Random(seed)
+    words = [keb or reb for keb, reb, _ in vocabulary]
+    with open(path, 'w', encoding='utf-8') as file:
+        for i in range(1, count + 1):
+            parts = []
+            for _ in range(rng.randint(2, 5)):
+                parts.append(rng.choice(words))
+                parts.append(rng.choice(PARTICLES))
+            text = "".join(parts[:-1]) + rng.choice(ENDINGS)
+            added = f"20{rng.randint(8, 23):02d}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:34:56"
+            modified = "\\N" if rng.random() < 0.3 else added
+            if rng.random() < 0.01:
+                added = "0000-00-00 00:00:00"
+            file.write(f"{i}\tjpn\t{text}\tuser{rng.randint(1, 500)}\t{added}\t{modified}\n")
+
+
+def write_ratings(path, sentence_count, count, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as file:
+        for _ in range(count):
+            rating = rng.choice(['1', '1', '0', '-1'])
+            file.write(f"user{rng.randint(1, 500)}\t{rng.randint(1, sentence_count)}\t{rating}\t"
+                       f"2015-01-01 00:00:00\t2015-01-01 00:00:00\n")
+
+
+def write_all(dicts_path, entries, sentences, ratings, seed=0):
+    os.makedirs(dicts_path, exist_ok=True)
+    vocabulary = make_vocabulary(entries, seed)
+    write_jmdict(os.path.join(dicts_path, 'JMdict_e.xml'), vocabulary, seed)
+    write_furigana(os.path.join(dicts_path, 'JmdictFurigana.json'), vocabulary)
+    write_sentences(os.path.join(dicts_path, 'jpn_sentences_detailed.tsv'), vocabulary, sentences, seed)
+    write_ratings(os.path.join(dicts_path, 'users_sentences.csv'), sentences, ratings, seed)
+    return vocabulary
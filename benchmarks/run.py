@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import anki_stub
+import fixtures
+
+# Times the add-on outside Anki against synthetic dictionaries and writes the numbers as JSON, so runs on
+# two commits can be compared:
+#
+#   python benchmarks/run.py --output before.json
+#   git checkout other-commit
+#   python benchmarks/run.py --output after.json
+
+REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+NOTE_TYPE = {"name": "Japanese", "id": 1,
+             "fields": ["Front", "FuriganaField", "Meaning", "Reading", "WordType", "Examples"]}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_PATH, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_addon():
+    # Imported under a fixed name whatever the checkout folder is called
+    spec = importlib.util.spec_from_file_location("anki_furigana", os.path.join(REPO_PATH, "__init__.py"),
+                                                  submodule_search_locations=[REPO_PATH])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["anki_furigana"] = package
+    spec.loader.exec_module(package)
+    return importlib.import_module("anki_furigana.kanji_furi")
+
+
+def summarise(durations):
+    durations = sorted(durations)
+    return {"calls": len(durations), "total_s": sum(durations),
+            "mean_us": statistics.fmean(durations) * 1e6 if durations else 0,
+            "p50_us": durations[len(durations) // 2] * 1e6 if durations else 0,
+            "p95_us": durations[int(len(durations) * 0.95)] * 1e6 if durations else 0}
+
+
+def time_calls(function, inputs):
+    durations = []
+    for value in inputs:
+        start = time.perf_counter()
+        function(value)
+        durations.append(time.perf_counter() - start)
+    return summarise(durations)
+
+
+def make_notes(words, first_id):
+    return [anki_stub.Note(NOTE_TYPE, [word, "", "", "", "", ""], note_id)
+            for note_id, word in enumerate(words, start=first_id)]
+
+
+def clear_lookup_cache(kanji_furi):
+    # Older commits kept the lookups in kanji_furi itself
+    if hasattr(kanji_furi, "engine"):
+        kanji_furi.engine.clear_cache()
+    else:
+        kanji_furi.lookup_fields.cache_clear()
+
+
+def loaded_resources(kanji_furi):
+    if hasattr(kanji_furi, "engine"):
+        return kanji_furi.engine.furigana, kanji_furi.engine.sentences
+    return kanji_furi.furigana_index, kanji_furi.jsl
+
+
+def furigana_search(kanji_furi):
+    # Lives in lookup_engine, older commits had it in kanji_furi
+    try:
+        return importlib.import_module("anki_furigana.lookup_engine").search_furigana
+    except ImportError:
+        return kanji_furi.search_furigana
+
+
+def time_startup(kanji_furi, needed=None):
+    # needed limits it to those resources, on commits that load them on demand
+    if hasattr(kanji_furi, "unload_all_dictionaries"):
+        kanji_furi.unload_all_dictionaries()
+    kanji_furi.load_state = kanji_furi.LOAD_STATE_NOT_STARTED
+    start = time.perf_counter()
+    if needed is not None:
+        kanji_furi.start_loading_dictionaries(needed)
+    else:
+        kanji_furi.start_loading_dictionaries()
+    seconds = time.perf_counter() - start
+    if kanji_furi.load_state != kanji_furi.LOAD_STATE_READY:
+        raise RuntimeError(f"Dictionaries didn't load, state is {kanji_furi.load_state}")
+    return {"seconds": seconds, "stages": dict(kanji_furi.load_times)}
+
+
+def time_batch_update(kanji_furi, collection):
+    note_ids = list(collection.notes)
+    writes = collection.writes
+    start = time.perf_counter()
+    if hasattr(kanji_furi, "plan_batch_update"):
+        planned, found, _ = kanji_furi.plan_batch_update(collection, NOTE_TYPE, "Front")
+        kanji_furi.run_batch_update(collection, planned, "Front", found, threading.Event(),
+                                    lambda processed, updated: None)
+    else:
+        kanji_furi.run_batch_update(collection, note_ids, "Front", threading.Event(),
+                                    lambda processed, updated: None)
+    seconds = time.perf_counter() - start
+    return {"notes": len(note_ids), "seconds": seconds, "notes_per_second": len(note_ids) / seconds if seconds else 0,
+            "writes": collection.writes - writes}
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = {"commit": git_commit(), "python": platform.python_version(), "parameters": vars(args)}
+    work_path = tempfile.mkdtemp(prefix="furigana_bench_")
+    try:
+        dicts_path = os.path.join(work_path, "dicts") + os.sep
+        start = time.perf_counter()
+        vocabulary = fixtures.write_all(dicts_path, args.entries, args.sentences, args.ratings, args.seed)
+        results["fixture_seconds"] = time.perf_counter() - start
+        words = [keb or reb for keb, reb, _ in vocabulary]
+
+        with open(os.path.join(REPO_PATH, "config.json"), encoding="utf-8") as file:
+            config = json.load(file)
+        collection = anki_stub.Collection([NOTE_TYPE], [])
+        mw = anki_stub.install(config, collection)
+
+        start = time.perf_counter()
+        kanji_furi = load_addon()
+        results["import_seconds"] = time.perf_counter() - start
+        kanji_furi.dicts_path = dicts_path
+
+        results["cold_startup"] = time_startup(kanji_furi)
+        if hasattr(kanji_furi, "RESOURCE_FURIGANA"):
+            # Only the Furigana field in use
+            results["furigana_only_startup"] = time_startup(kanji_furi, {kanji_furi.RESOURCE_FURIGANA})
+        results["warm_startup"] = time_startup(kanji_furi)
+
+        queries = [rng.choice(words) for _ in range(args.queries)]
+        furigana, sentences = loaded_resources(kanji_furi)
+        search_furigana = furigana_search(kanji_furi)
+        results["search_furigana"] = time_calls(lambda word: search_furigana(furigana, word), queries)
+        number_of_sentences = config.get(kanji_furi.SETTING_NUM_SENTENCES, 5)
+        results["find_example_sentences_by_word"] = time_calls(
+            lambda word: sentences.find_example_sentences_by_word(word, number_of_sentences), queries)
+
+        clear_lookup_cache(kanji_furi)
+        notes = make_notes(queries, 1)
+        results["update_note_cold"] = time_calls(lambda note: kanji_furi.update_note(note, note["Front"]), notes)
+        notes = make_notes(queries, 1)
+        results["update_note_warm"] = time_calls(lambda note: kanji_furi.update_note(note, note["Front"]), notes)
+
+        clear_lookup_cache(kanji_furi)
+        batch_words = [rng.choice(words) for _ in range(args.notes)]
+        mw.col = anki_stub.Collection([NOTE_TYPE], make_notes(batch_words, 1))
+        results["batch_update"] = time_batch_update(kanji_furi, mw.col)
+        # Running it again finds nothing left to do
+        results["batch_update_rerun"] = time_batch_update(kanji_furi, mw.col)
+        if hasattr(kanji_furi, "lookup_stats"):
+            results["lookup_stats"] = kanji_furi.lookup_stats.to_dict()
+        results["artifact_sizes"] = {name: os.path.getsize(os.path.join(dicts_path, name))
+                                     for name in sorted(os.listdir(dicts_path))}
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the furigana add-on on synthetic dictionaries.")
+    parser.add_argument("--entries", type=int, default=20000, help="JMdict entries")
+    parser.add_argument("--sentences", type=int, default=50000, help="Tatoeba sentences")
+    parser.add_argument("--ratings", type=int, default=100000, help="Tatoeba sentence ratings")
+    parser.add_argument("--queries", type=int, default=1000, help="lookups per timed function")
+    parser.add_argument("--notes", type=int, default=5000, help="notes in the batch update")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON here as well as printing it")
+    args = parser.parse_args()
+    # The add-on prints its load times, keep those out of the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args)
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import artifacts, dict_store, jmdict_xml, sentence_examples
+
+# Builds the runtime artifacts (furigana.sqlite, jmdict.sqlite, sentences.pickle) from the source downloads.
+# The add-on calls these when an artifact is missing or stale, and they can be run without Anki to prebuild
+# the artifacts and ship them:
+#
+#   python -m anki_furigana.compile_dicts --dicts path/to/dicts
+#
+# from the folder that holds the add-on. Nothing in here may import aqt.
+
+FURIGANA_STORE = 'furigana.sqlite'
+JMDICT_STORE = 'jmdict.sqlite'
+SENTENCES_PICKLE = 'sentences.pickle'
+
+# Bump when build_furigana_index changes what it stores
+FURIGANA_STORE_FORMAT = 1
+
+STAGES = ["furigana", "jmdict", "sentences"]
+
+
+def render_furigana(furigana):
+    result = ""
+    last_no_kanji = False
+    for fu in furigana:
+        if "rt" in fu:
+            if last_no_kanji:
+                result += " "
+            result += fu['ruby']
+            result += "[" + fu['rt'] + "]"
+        else:
+            result += fu['ruby']
+            last_no_kanji = True
+    return result
+
+
+def build_furigana_index(data):
+    # Maps text -> every reading for that text in file order, so homographs are kept
+    # and the first one still wins for the plain lookup.
+    index = {}
+    for obj in data:
+        index.setdefault(obj['text'], []).append({"reading": obj.get('reading', ""),
+                                                  "furigana": obj['furigana'],
+                                                  "rendered": render_furigana(obj['furigana'])})
+    return index
+
+
+def furigana_sources(dicts_path):
+    return {"JmdictFurigana.json": os.path.join(dicts_path, 'JmdictFurigana.json')}
+
+
+def jmdict_sources(dicts_path):
+    xml_file = os.path.join(dicts_path, 'JMdict_e.xml')
+    data_file = os.path.join(dicts_path, 'dill.pkl')
+    # An old dill.pkl can stand in for the XML, the release doesn't ship the XML
+    if not os.path.isfile(xml_file) and os.path.isfile(data_file):
+        return {"dill.pkl": data_file}
+    return {"JMdict_e.xml": xml_file}
+
+
+def sentence_sources(dicts_path):
+    # Won't include these in the release... However... can be downloaded from the following.
+    # https://tatoeba.org/en/downloads
+    return {"jpn_sentences_detailed.tsv": os.path.join(dicts_path, 'jpn_sentences_detailed.tsv'),
+            "users_sentences.csv": os.path.join(dicts_path, 'users_sentences.csv')}
+
+
+def needs_build(path, header, kind, format_version, sources):
+    if not os.path.isfile(path):
+        return True
+    if artifacts.header_is_current(header, kind, format_version, sources):
+        return False
+    if artifacts.sources_available(sources):
+        print(f"{os.path.basename(path)} is out of date.")
+        return True
+    # Nothing to rebuild it from, so use what's there
+    return False
+
+
+def furigana_store_needs_build(dicts_path):
+    store_file = os.path.join(dicts_path, FURIGANA_STORE)
+    header = dict_store.read_header(store_file) if os.path.isfile(store_file) else None
+    return needs_build(store_file, header, "furigana", FURIGANA_STORE_FORMAT, furigana_sources(dicts_path))
+
+
+def build_furigana_store(dicts_path):
+    sources = furigana_sources(dicts_path)
+    header = artifacts.make_header("furigana", FURIGANA_STORE_FORMAT, sources)
+    with open(sources["JmdictFurigana.json"], 'r', encoding='utf-8-sig') as f:
+        index = build_furigana_index(json.load(f))
+    store_file = os.path.join(dicts_path, FURIGANA_STORE)
+    dict_store.write_store(store_file, index.items(), header)
+    return store_file
+
+
+def jmdict_store_needs_build(dicts_path):
+    store_file = os.path.join(dicts_path, JMDICT_STORE)
+    header = dict_store.read_header(store_file) if os.path.isfile(store_file) else None
+    return needs_build(store_file, header, "jmdict", jmdict_xml.ENTRY_FORMAT, jmdict_sources(dicts_path))
+
+
+def build_jmdict_store(dicts_path):
+    sources = jmdict_sources(dicts_path)
+    header = artifacts.make_header("jmdict", jmdict_xml.ENTRY_FORMAT, sources)
+    if "dill.pkl" in sources:
+        with open(sources["dill.pkl"], 'rb') as file:
+            output = pickle.load(file)
+        readings = jmdict_xml.readings_from_entries(output)
+    else:
+        output, readings = jmdict_xml.build_dicts_from_file(sources["JMdict_e.xml"])
+    store_file = os.path.join(dicts_path, JMDICT_STORE)
+    dict_store.write_store(store_file, output.items(), header, readings.items())
+    return store_file
+
+
+def sentence_pickle_needs_build(dicts_path):
+    pickle_file = os.path.join(dicts_path, SENTENCES_PICKLE)
+    header = sentence_examples.read_pickle_header(pickle_file) if os.path.isfile(pickle_file) else None
+    return needs_build(pickle_file, header, sentence_examples.PICKLE_KIND, sentence_examples.PICKLE_FORMAT,
+                       sentence_sources(dicts_path))
+
+
+def sentence_pickle_can_update(dicts_path):
+    # A pickle in the current format can take a newer export in place, see update_sentence_lib
+    pickle_file = os.path.join(dicts_path, SENTENCES_PICKLE)
+    if not os.path.isfile(pickle_file) or not artifacts.sources_available(sentence_sources(dicts_path)):
+        return False
+    return artifacts.header_matches_format(sentence_examples.read_pickle_header(pickle_file),
+                                           sentence_examples.PICKLE_KIND, sentence_examples.PICKLE_FORMAT)
+
+
+def update_sentence_lib(dicts_path, workers=1):
+    # Applies a newer Tatoeba export to the existing pickle, only the changed sentences are re-indexed
+    sources = sentence_sources(dicts_path)
+    header = artifacts.make_header(sentence_examples.PICKLE_KIND, sentence_examples.PICKLE_FORMAT, sources)
+    pickle_file = os.path.join(dicts_path, SENTENCES_PICKLE)
+    lib = sentence_examples.JapaneseSentenceLib()
+    lib.load_pickle_file(pickle_file)
+    counts = lib.update_from_files(sources["jpn_sentences_detailed.tsv"], sources["users_sentences.csv"], workers)
+    print(f"Updated {SENTENCES_PICKLE}: {counts['added']} added, {counts['modified']} modified, "
+          f"{counts['removed']} removed, {counts['rerated']} re-rated")
+    lib.save_pickle_file(pickle_file, header)
+    return lib
+
+
+def build_sentence_lib(dicts_path, ranking=sentence_examples.RANK_BY_DATE, rating_weight=0.5, workers=1):
+    # Anki's bundled Python can't be relied on to start worker processes, so parsing in parallel is opt in
+    sources = sentence_sources(dicts_path)
+    header = artifacts.make_header(sentence_examples.PICKLE_KIND, sentence_examples.PICKLE_FORMAT, sources)
+    lib = sentence_examples.JapaneseSentenceLib()
+    lib.load_sentences_from_file(sources["jpn_sentences_detailed.tsv"], workers)
+    lib.load_sentence_rating_data(sources["users_sentences.csv"], workers)
+    lib.set_ranking(ranking, rating_weight)
+    lib.save_pickle_file(os.path.join(dicts_path, SENTENCES_PICKLE), header)
+    return lib
+
+
+def run_stage(stage, dicts_path, force, ranking, rating_weight, parse_workers):
+    # Runs in a worker process, only sends back the numbers
+    start = time.perf_counter()
+    if stage == "furigana":
+        needed = force or furigana_store_needs_build(dicts_path)
+        output = build_furigana_store(dicts_path) if needed else os.path.join(dicts_path, FURIGANA_STORE)
+    elif stage == "jmdict":
+        needed = force or jmdict_store_needs_build(dicts_path)
+        output = build_jmdict_store(dicts_path) if needed else os.path.join(dicts_path, JMDICT_STORE)
+    else:
+        needed = force or sentence_pickle_needs_build(dicts_path)
+        output = os.path.join(dicts_path, SENTENCES_PICKLE)
+        if needed and not force and sentence_pickle_can_update(dicts_path):
+            lib = update_sentence_lib(dicts_path, parse_workers)
+            if lib.set_ranking(ranking, rating_weight):
+                lib.save_pickle_file(output)
+        elif needed:
+            build_sentence_lib(dicts_path, ranking, rating_weight, parse_workers)
+        else:
+            # Up to date, but it may still be in another order than the one asked for
+            lib = sentence_examples.JapaneseSentenceLib()
+            lib.load_pickle_file(output)
+            if lib.set_ranking(ranking, rating_weight):
+                lib.save_pickle_file(output)
+                needed = True
+    return {"stage": stage, "built": needed, "output": output, "seconds": time.perf_counter() - start,
+            "size": os.path.getsize(output)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the furigana add-on dictionaries without Anki.")
+    parser.add_argument("--dicts", default=os.path.join(os.path.dirname(__file__), "dicts"),
+                        help="folder holding the downloads, the artifacts are written next to them")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild from scratch even if the artifacts are up to date or could be updated in place")
+    parser.add_argument("--jobs", type=int, default=len(STAGES), help="worker processes, 1 runs in process")
+    parser.add_argument("--ranking", choices=sentence_examples.RANKINGS, default=sentence_examples.RANK_BY_DATE)
+    parser.add_argument("--rating-weight", type=float, default=0.5)
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for parsing the Tatoeba files, 1 parses them serially")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stage_args = [(stage, args.dicts, args.force, args.ranking, args.rating_weight, args.parse_workers)
+                  for stage in args.stages]
+    if args.jobs <= 1:
+        results = [run_stage(*stage) for stage in stage_args]
+    else:
+        # The stages don't share any inputs or outputs, so they can all run at once
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(run_stage, *zip(*stage_args)))
+    for result in results:
+        state = "built" if result["built"] else "up to date"
+        print(f"{result['stage']:<10} {state:<11} {result['seconds']:8.2f}s {result['size'] / 1e6:9.1f} MB  "
+              f"{result['output']}")
+    print(f"Total {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from . import artifacts
+
+# Read-only key -> entry lookups backed by an SQLite file, so only the keys that are actually looked up
+# get decoded. Several keys can point at the same entry (every keb of a JMdict entry shares its senses),
+# so entries are stored once and keys just hold the entry id. JMdict stores also map each kana reading to
+# every entry with that reading, best first, as (reading, rank) -> entry id rows.
+
+# Keys per query in get_many, older SQLite builds cap a statement at 999 parameters
+QUERY_CHUNK_SIZE = 500
+
+
+def write_store(path, items, header=None, readings=None):
+    # items is an iterable of (key, value), values that are the same object are only written once.
+    # readings is an iterable of (reading, [value, ...]), the values can be the ones in items.
+    def write(tmp_path):
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute("CREATE TABLE meta (header TEXT NOT NULL)")
+            connection.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY, value TEXT NOT NULL)")
+            connection.execute("CREATE TABLE keys (key TEXT PRIMARY KEY, entry_id INTEGER NOT NULL) WITHOUT ROWID")
+            connection.execute("INSERT INTO meta VALUES (?)", (json.dumps(header),))
+            entry_ids = {}
+            # Keep the values alive so their id() can't be reused by a later value
+            written = []
+
+            def entry_id_for(value):
+                entry_id = entry_ids.get(id(value))
+                if entry_id is None:
+                    entry_id = len(entry_ids) + 1
+                    entry_ids[id(value)] = entry_id
+                    written.append(value)
+                    connection.execute("INSERT INTO entries VALUES (?, ?)",
+                                       (entry_id, json.dumps(value, ensure_ascii=False)))
+                return entry_id
+
+            for key, value in items:
+                connection.execute("INSERT OR IGNORE INTO keys VALUES (?, ?)", (key, entry_id_for(value)))
+            if readings is not None:
+                connection.execute("CREATE TABLE readings (reading TEXT NOT NULL, rank INTEGER NOT NULL, "
+                                   "entry_id INTEGER NOT NULL, PRIMARY KEY (reading, rank)) WITHOUT ROWID")
+                for reading, values in readings:
+                    connection.executemany("INSERT INTO readings VALUES (?, ?, ?)",
+                                           [(reading, rank, entry_id_for(value)) for rank, value in enumerate(values)])
+            connection.commit()
+        finally:
+            connection.close()
+
+    artifacts.atomic_write(path, write)
+
+
+def read_header(path):
+    # None for stores from before headers existed, or files that aren't a store at all
+    try:
+        connection = sqlite3.connect(Path(path).absolute().as_uri() + "?mode=ro", uri=True)
+        try:
+            row = connection.execute("SELECT header FROM meta").fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0]) if row is not None else None
+
+
+class DictStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(Path(path).absolute().as_uri() + "?mode=ro", uri=True,
+                                          check_same_thread=False)
+        # The connection is shared by the editor and background tasks
+        self.lock = threading.Lock()
+        self.cache = {}
+        # entry id -> decoded entry, so keys sharing an entry share one decoded copy
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, value, entry_id):
+        return json.loads(value)
+
+    def load(self, entry_id, value):
+        entry = self.entries.get(entry_id)
+        if entry is None:
+            entry = self.entries[entry_id] = self.decode(value, entry_id)
+        return entry
+
+    def get(self, key, default=None):
+        if key in self.cache:
+            self.hits += 1
+            entry = self.cache[key]
+            return default if entry is None else entry
+        self.misses += 1
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT entries.id, entries.value FROM keys JOIN entries ON entries.id = keys.entry_id "
+                "WHERE keys.key = ?", (key,)).fetchone()
+        entry = self.load(*row) if row is not None else None
+        self.cache[key] = entry
+        return default if entry is None else entry
+
+    def get_many(self, keys):
+        # {key: entry} for the keys that exist, everything not cached yet comes back in one query per chunk
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key in self.cache:
+                self.hits += 1
+                if self.cache[key] is not None:
+                    found[key] = self.cache[key]
+            else:
+                self.misses += 1
+                missing.append(key)
+        for chunk_start in range(0, len(missing), QUERY_CHUNK_SIZE):
+            chunk = missing[chunk_start:chunk_start + QUERY_CHUNK_SIZE]
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT keys.key, entries.id, entries.value FROM keys JOIN entries ON entries.id = keys.entry_id "
+                    f"WHERE keys.key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for key, entry_id, value in rows:
+                found[key] = self.cache[key] = self.load(entry_id, value)
+            for key in chunk:
+                self.cache.setdefault(key, None)
+        return found
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "entries": len(self.entries)}
+
+    def keys(self):
+        with self.lock:
+            return [key for (key,) in self.connection.execute("SELECT key FROM keys")]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class JmdictStore(DictStore):
+    def __init__(self, path):
+        super().__init__(path)
+        # Stores built before the readings table existed still work, they just can't look up kana
+        self.has_readings = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'readings'").fetchone() is not None
+        self.reading_cache = {}
+
+    def get_many_by_reading(self, readings):
+        # {reading: best entry} for the readings that exist
+        found = {}
+        missing = []
+        for reading in dict.fromkeys(readings):
+            if reading in self.reading_cache:
+                self.hits += 1
+                if self.reading_cache[reading] is not None:
+                    found[reading] = self.reading_cache[reading]
+            else:
+                self.misses += 1
+                missing.append(reading)
+        if not self.has_readings:
+            return found
+        for chunk_start in range(0, len(missing), QUERY_CHUNK_SIZE):
+            chunk = missing[chunk_start:chunk_start + QUERY_CHUNK_SIZE]
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT readings.reading, entries.id, entries.value FROM readings JOIN entries "
+                    "ON entries.id = readings.entry_id "
+                    f"WHERE readings.rank = 0 AND readings.reading IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+            for reading, entry_id, value in rows:
+                found[reading] = self.reading_cache[reading] = self.load(entry_id, value)
+            for reading in chunk:
+                self.reading_cache.setdefault(reading, None)
+        return found
+
+    def readings(self):
+        # Every reading in the readings table, or for older stores the first reb of every entry without
+        # decoding the rest of it where SQLite has JSON support
+        with self.lock:
+            if self.has_readings:
+                return [reading for (reading,) in self.connection.execute("SELECT DISTINCT reading FROM readings")]
+            try:
+                rows = self.connection.execute("SELECT DISTINCT json_extract(value, '$.reb') FROM entries").fetchall()
+                return [reb for (reb,) in rows if reb]
+            except sqlite3.OperationalError:
+                rows = self.connection.execute("SELECT value FROM entries").fetchall()
+        return [reb for reb in (json.loads(value).get("reb") for (value,) in rows) if reb]
+
+    def decode(self, value, entry_id):
+        entry = json.loads(value)
+        # JSON turns the sense numbers into strings
+        entry["senses"] = {int(number): sense for number, sense in entry["senses"].items()}
+        # Lets the lookup engine cache what it renders from the entry
+        entry["entry_id"] = entry_id
+        return entry
@@ -0,0 +1,121 @@
+import re
+import xml.etree.ElementTree as Et
+
+# Streaming JMdict_e.xml reader. Entries are handled one at a time and cleared straight after, so memory
+# stays flat however big the file is instead of holding the whole tree.
+
+# Bump when parse_entry changes what it stores
+ENTRY_FORMAT = 3
+
+# What the uk entity expands to, these entries are looked up by their kana more often than not
+USUALLY_KANA = "word usually written using kana alone"
+
+ENTITY_PATTERN = re.compile(r'<!ENTITY\s+(\S+)\s+"([^"]*)"\s*>')
+
+
+def read_dtd_entities(filepath):
+    # The DTD sits at the top of the file, stop reading once it's done
+    entities = {}
+    with open(filepath, 'r', encoding='utf-8') as file:
+        for line in file:
+            match = ENTITY_PATTERN.search(line)
+            if match:
+                entities[match.group(1)] = match.group(2)
+            if line.startswith(']>'):
+                break
+    return entities
+
+
+def resolve_entity(text, entities):
+    # expat already expands &n; and friends, this covers parsers that hand them back untouched
+    if text and "&" in text and ';' in text:
+        entity_value = text.replace('&', '').replace(';', '')
+        full_string = entities.get(entity_value)
+        return full_string if full_string else text
+    return text
+
+
+def parts_of_speech_conversion(input_str: str) -> str:
+    lowered = input_str.lower()
+    output_str = ""
+    if "noun" in lowered:
+        output_str += "名詞、"
+    if "godan" in lowered:
+        output_str += "五段、"
+    if "ichidan" in lowered:
+        output_str += "一段、"
+    if "suru" in lowered:
+        output_str += "する、"
+    if input_str.startswith("transitive verb") or " transitive verb" in lowered:
+        output_str += "他動詞、"
+    if "intransitive verb" in lowered:
+        output_str += "自動詞、"
+    if "adjective (keiyoushi)" in lowered:
+        output_str += "いー形容詞、"
+    if "adjectival nouns" in lowered:
+        output_str += "なー形容詞、"
+    return output_str.strip("、")
+
+
+def parse_entry(entry, entities):
+    # Returns (kebs, [(reb, preference)], payload). Lower preference wins when several entries share a reading:
+    # kana only and usually-kana entries come first, then readings JMdict marks as common.
+    kebs = [keb.text for keb in entry.findall('k_ele/keb')]
+    # Keep the first seen order so the output is the same on every build
+    parts_of_speech_values = {}
+    for pos in entry.findall('sense/pos'):
+        parts_of_speech_values[resolve_entity(pos.text, entities)] = None
+    senses = {}
+    for i, sense in enumerate(entry.iter('sense'), start=1):
+        glosses = [gloss.text for gloss in sense.iter('gloss')]
+        senses[i] = '; '.join(glosses)
+    reb = entry.findall('r_ele/reb')[0].text.strip()
+    kana_first = not kebs or any(resolve_entity(misc.text, entities) == USUALLY_KANA
+                                 for misc in entry.findall('sense/misc'))
+    readings = []
+    for r_ele in entry.findall('r_ele'):
+        common = r_ele.find('re_pri') is not None
+        readings.append((r_ele.find('reb').text.strip(), (0 if kana_first else 2) + (0 if common else 1)))
+    parts_of_speech = '; '.join(parts_of_speech_values)
+    # The Japanese word type is stored ready to use so lookups don't redo it
+    return kebs, readings, {"parts_of_speech_values": parts_of_speech, "senses": senses, "reb": reb,
+                            "pos_ja": parts_of_speech_conversion(parts_of_speech)}
+
+
+def iter_entries(filepath, entities=None):
+    if entities is None:
+        entities = read_dtd_entities(filepath)
+    root = None
+    for event, element in Et.iterparse(filepath, events=('start', 'end')):
+        if root is None:
+            root = element
+        elif event == 'end' and element.tag == 'entry':
+            yield parse_entry(element, entities)
+            # Drop the finished entry, otherwise the root keeps every entry alive
+            root.clear()
+
+
+def build_dicts_from_file(filepath):
+    # (keb -> entry, reb -> entries best first). Entries sharing a reading are the same objects as in the
+    # keb dict, so the store writes each one once.
+    output = {}
+    readings = {}
+    for order, (kebs, entry_readings, payload) in enumerate(iter_entries(filepath)):
+        for keb in kebs:
+            if keb not in output:
+                output[keb] = payload
+        for reb, preference in entry_readings:
+            readings.setdefault(reb, []).append((preference, order, payload))
+    return output, {reb: [payload for _, _, payload in sorted(found, key=lambda item: item[:2])]
+                    for reb, found in readings.items()}
+
+
+def readings_from_entries(output):
+    # For an old dill.pkl, which only has the keb entries and their first reading
+    readings = {}
+    seen = set()
+    for payload in output.values():
+        if id(payload) not in seen:
+            seen.add(id(payload))
+            readings.setdefault(payload["reb"], []).append(payload)
+    return readings
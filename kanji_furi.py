@@ -2,89 +2,73 @@ from __future__ import annotations
 
 import json
 import os
-import xml.etree.ElementTree as Et
-import pickle
+import threading
+import time
+import weakref
 
-from PyQt6.QtGui import QAction
+from PyQt6.QtGui import QAction, QFontDatabase
 from PyQt6.QtWidgets import QDialog, QHBoxLayout, QLabel, QLineEdit, QDialogButtonBox, QVBoxLayout, QSpinBox, QCheckBox, \
-    QComboBox, QProgressBar
+    QComboBox, QProgressBar, QPlainTextEdit, QFileDialog
+from anki.collection import OpChanges
 from anki.notes import Note
 from aqt import gui_hooks, qconnect, mw
+from aqt.operations import CollectionOp, QueryOp
+from aqt.operations.note import update_note as update_note_op
+from aqt.utils import askUser, showInfo, tooltip
 
-from . import sentence_examples
+from . import artifacts, compile_dicts, dict_store, lookup_engine, result_cache, segmenter, sentence_examples
+from .lookup_engine import SETTING_SRC_FIELD, SETTING_FURI_DEST_FIELD, SETTING_KANA_DEST_FIELD, \
+    SETTING_TYPE_DEST_FIELD, SETTING_MEANING_FIELD, SETTING_NUM_DEFS, SETTING_NUM_SENTENCES, \
+    SETTING_SENTENCE_DEST_FIELD, SETTING_USE_ORDERED_LIST, SETTING_SENTENCE_RANKING, SETTING_SENTENCE_RATING_WEIGHT, \
+    SETTING_SENTENCE_MIN_RATING, SETTING_SEGMENT_MODE, SETTING_SEGMENT_DEFINITIONS, DEST_SETTINGS, FORMAT_SETTINGS, \
+    RESOURCE_FURIGANA, RESOURCE_JMDICT, RESOURCE_SENTENCES, RESOURCES, LookupEngine
+from .stats import Stats
 
-SETTING_SRC_FIELD = "kanji_field"
-SETTING_FURI_DEST_FIELD = "furigana_field"
-SETTING_KANA_DEST_FIELD = "kana_field"
-SETTING_TYPE_DEST_FIELD = "type_field"
-SETTING_MEANING_FIELD = "definition_field"
-SETTING_NUM_DEFS = "number_of_defs"
-SETTING_NUM_SENTENCES = "number_of_sentences"
-SETTING_SENTENCE_DEST_FIELD = "sentence_field"
-SETTING_USE_ORDERED_LIST = "use_ordered_list"
-
-# This is used to prevent excessive lookups
-previous_srcTxt = None
+SETTING_COLLECT_STATS = "collect_stats"
+SETTING_SENTENCE_CACHE_SIZE = "sentence_cache_size"
 
 dicts_path = os.path.join(os.path.dirname(__file__), "dicts/")
-
-
-def load_xml_file(filepath):
-    try:
-        tree = Et.parse(filepath)
-        root = tree.getroot()
-        return root
-    except FileNotFoundError:
-        print(f"File {filepath} not found.")
-        return None
-    except Et.ParseError:
-        print(f"Error parsing the file {filepath}.")
-        return None
-
-
-def build_dict_from_xml(root):
-    output = {}
-    for entry in root.iter('entry'):
-        parts_of_speech_values = set()
-        keb_entries = set()
-        for keb_entry in entry.findall('k_ele/keb'):
-            keb_entries.add(keb_entry.text)
-        pos_elements = entry.findall('sense/pos')
-        for pos in pos_elements:
-            # Check if <!ENTITY> in tag text and replace with full string
-            pos_text = pos.text
-            if pos_text and "&" in pos_text and ';' in pos_text:
-                entity_value = pos_text.replace('&', '').replace(';', '')
-                full_string = root.docinfo.internalDTD.entities.get(entity_value)
-                parts_of_speech_values.add(full_string if full_string else pos_text)
-            else:
-                parts_of_speech_values.add(pos_text)
-
-        senses = {}
-        for i, sense in enumerate(entry.iter('sense'), start=1):
-            glosses = [gloss.text for gloss in sense.iter('gloss')]
-            gloss_text = '; '.join(glosses)
-            senses[i] = f"{gloss_text}"
-        reb = entry.findall('r_ele/reb')[0].text.strip()
-        for ke in keb_entries:
-            if ke not in output:
-                output[ke] = {"parts_of_speech_values": '; '.join(parts_of_speech_values),
-                              "senses": senses, "reb": reb}
-    return output
-
-def get_senses(dict_item, limit=5):
-    numbers = list(range(1, limit+1))
-    arry = []
-    for idx, number in enumerate(numbers):
-        if number in dict_item["senses"]:
-            if config.get(SETTING_USE_ORDERED_LIST, False):
-                arry.append(dict_item["senses"][number])
-            else:
-                arry.append(f"{idx + 1}. {dict_item['senses'][number]}")
-    if config.get(SETTING_USE_ORDERED_LIST, False):
-        return f"<ol>{''.join(f'<li>{item}</li>' for item in arry)}</ol>"
-    else:
-        return "<br>".join(arry)
+sentences_pickle_file = compile_dicts.SENTENCES_PICKLE
+
+# Notes per write during a batch update
+BATCH_CHUNK_SIZE = 500
+
+# How long an editor lookup waits on dictionaries that are still loading before giving up. It waits on a
+# worker thread, so the editor stays usable meanwhile.
+FOCUS_LOST_LOAD_TIMEOUT = 30.0
+
+# Dictionaries are loaded on a background thread the first time a lookup needs them, and only the ones some
+# note type has a field for. dicts_ready is set whenever no load is in flight.
+LOAD_STATE_NOT_STARTED = "not loaded"
+LOAD_STATE_LOADING = "loading"
+LOAD_STATE_READY = "ready"
+LOAD_STATE_FAILED = "failed"
+load_state = LOAD_STATE_NOT_STARTED
+load_times = {}
+dicts_ready = threading.Event()
+dicts_ready.set()
+load_status_action = None
+# Resources (lookup_engine.RESOURCES) in the engine, and the ones lookups have asked for so far
+loaded_resources = set()
+requested_resources = set()
+# Whether apply_sentence_ranking is re-sorting the example sentences on a worker
+sentence_ranking_running = False
+
+# Open editors, so a finished lookup can tell whether its note is still the one being edited
+editors = weakref.WeakSet()
+# Editor lookups in flight as (id of the note, source text), tabbing through the field again while one
+# runs doesn't start another
+pending_lookups = set()
+
+# Timings for the stats dialog, switched on and off by SETTING_COLLECT_STATS
+lookup_stats = Stats()
+# Does the lookups, the loader hands it the dictionaries once they're in
+engine = LookupEngine(stats=lookup_stats)
+lookup_stats.add_counter_source("lookup fields", lambda: engine.cache_info())
+lookup_stats.add_counter_source("furigana store", lambda: store_cache_info(engine.furigana))
+lookup_stats.add_counter_source("jmdict store", lambda: store_cache_info(engine.jmdict))
+lookup_stats.add_counter_source("sentence cache", lambda: engine.sentence_cache.cache_info()
+                                if engine.sentence_cache is not None else {})
 
 
 def search_def(root, keb_text, def_limit=0):
@@ -131,94 +115,131 @@ def search_pos(root, keb_text):
     return '; '.join(pos_values)
 
 
-def search_furigana(data, target_text):
-    for obj in data:
-        if obj['text'] == target_text:
-            furigana = obj['furigana']
-            result = ""
-            last_no_kanji = False
-            for fu in furigana:
-                if "rt" in fu:
-                    if last_no_kanji:
-                        result += " "
-                    result += fu['ruby']
-                    result += "[" + fu['rt'] + "]"
-                else:
-                    result += fu['ruby']
-                    last_no_kanji = True
-            return result
-    return ""
-
-
-def parts_of_speech_conversion(input_str: str) -> str:
-    output_str = ""
-    if "noun" in input_str.lower():
-        output_str += "名詞、"
-    if "godan" in input_str.lower():
-        output_str += "五段、"
-    if "ichidan" in input_str.lower():
-        output_str += "一段、"
-    if "suru" in input_str.lower():
-        output_str += "する、"
-    if input_str.startswith("transitive verb") or " transitive verb" in input_str.lower():
-        output_str += "他動詞、"
-    if "intransitive verb" in input_str.lower():
-        output_str += "自動詞、"
-    if "adjective (keiyoushi)" in input_str.lower():
-        output_str += "いー形容詞、"
-    if "adjectival nouns" in input_str.lower():
-        output_str += "なー形容詞、"
-    return output_str.strip("、")
-
-
 def on_focus_lost(changed: bool, note: Note, current_field_index: int) -> bool:
-    # Get the field names
-    fields = mw.col.models.field_names(note.note_type())
-    # Get the modified field
-    modified_field = fields[current_field_index]
-    # Check if it's the same as config, if so proceed
-    if modified_field == config[SETTING_SRC_FIELD]:
+    with lookup_stats.timed("on_focus_lost"):
+        # Get the field names
+        fields = mw.col.models.field_names(note.note_type())
+        # Get the modified field
+        modified_field = fields[current_field_index]
+        # Check if it's the same as config, if so proceed
+        if modified_field != config[SETTING_SRC_FIELD]:
+            return changed
         # Strip for good measure
         src_txt = mw.col.media.strip(note[modified_field])
-        if src_txt != "" and (previous_srcTxt is None or src_txt != previous_srcTxt):
-            changed = update_note(note, src_txt)
+        wanted = tuple(setting for setting in DEST_SETTINGS if config.get(setting) in fields)
+        # Nothing to do once every destination is filled in, however often the field is left
+        if src_txt == "" or all(note[config.get(setting)] != "" for setting in wanted):
+            return changed
+        if ensure_dictionaries(wanted):
+            # Looked up before, fill it in now and let the editor reload as usual
+            cached = engine.cached(src_txt, config, wanted)
+            if cached is not None:
+                return fill_fields(fields, note, cached) or changed
+        key = (id(note), src_txt)
+        if key in pending_lookups:
+            return changed
+        pending_lookups.add(key)
+        mw.taskman.run_in_background(lambda: lookup_in_background(src_txt, wanted),
+                                     lambda future: on_lookup_done(future, note, src_txt, key))
     return changed
 
-def update_note(note: Note, src_txt):
+
+def lookup_in_background(src_txt, wanted):
+    # Runs on a worker thread, None when the dictionaries didn't become ready
+    if not wait_for_dictionaries(wanted, FOCUS_LOST_LOAD_TIMEOUT):
+        return None
+    with lookup_stats.timed("editor_lookup"):
+        return engine.lookup(src_txt, config, wanted)
+
+
+def on_lookup_done(future, note, src_txt, key):
+    # Back on the main thread
+    pending_lookups.discard(key)
+    try:
+        new_fields = future.result()
+    except Exception as e:
+        print(f"Furigana lookup for {src_txt} failed: {e}")
+        return
+    if new_fields is None:
+        tooltip(f"Furigana dictionaries are {load_state}, try again in a moment.")
+        return
+    # Only touch the note if it's still open and the source hasn't been changed since, otherwise the result
+    # is just left in the cache for next time
+    editor = next((editor for editor in editors if editor.note is note), None)
+    src_field = config[SETTING_SRC_FIELD]
+    if editor is None or src_field not in note or mw.col.media.strip(note[src_field]) != src_txt:
+        return
+    if fill_fields(mw.col.models.field_names(note.note_type()), note, new_fields):
+        if not note.id:
+            # Not added yet, the fields are saved with the rest when it is
+            editor.loadNoteKeepingFocus()
+            return
+        # Already in the collection, the editor won't save fields it didn't change itself. Going through the
+        # operation makes it an undo step and lets the browser and reviewer refresh.
+        update_note_op(parent=editor.widget, note=note).success(
+            lambda _changes: editor.loadNoteKeepingFocus()).run_in_background()
+
+
+def track_editor(editor):
+    editors.add(editor)
+
+
+def fill_fields(fields, note, new_fields):
+    # Returns whether any field was written
     changed = False
-    fields = mw.col.models.field_names(note.note_type())
-    # Added the field checks for people who don't have all fields for whatever reason
-    if config.get(SETTING_FURI_DEST_FIELD) in fields:
-        if insert_if_empty(fields, note, SETTING_FURI_DEST_FIELD, search_furigana(jmdict_furi_data, src_txt)):
-            changed = True
-    jmdict_info = dict_data.get(src_txt, None)
-    if jmdict_info is not None:
-        if config.get(SETTING_MEANING_FIELD) in fields:
-            def_num = config[SETTING_NUM_DEFS]
-            if insert_if_empty(fields, note, SETTING_MEANING_FIELD,
-                               get_senses(jmdict_info, def_num)):
-                changed = True
-        if config.get(SETTING_KANA_DEST_FIELD) in fields:
-            if insert_if_empty(fields, note, SETTING_KANA_DEST_FIELD, jmdict_info.get("reb", "")):
+    with lookup_stats.timed("note_write"):
+        for dest_config, new_text in new_fields.items():
+            if insert_if_empty(fields, note, dest_config, new_text):
                 changed = True
-        if config.get(SETTING_TYPE_DEST_FIELD) in fields:
-            if insert_if_empty(fields, note, SETTING_TYPE_DEST_FIELD,
-                               parts_of_speech_conversion(jmdict_info.get("parts_of_speech_values", ""))):
-                changed = True
-    if config.get(SETTING_SENTENCE_DEST_FIELD) in fields:
-        sentence_num = config[SETTING_NUM_SENTENCES]
-        if insert_if_empty(fields, note, SETTING_SENTENCE_DEST_FIELD, jsl.find_example_sentences_by_word_formatted(src_txt, sentence_num)):
-            changed = True
     return changed
 
+
+def update_note(note: Note, src_txt):
+    with lookup_stats.timed("update_note"):
+        return bool(apply_lookups([note], [src_txt]))
+
+
+def apply_lookups(notes, src_txts, found=None):
+    # Looks every distinct word up in one go, then fills in the notes. Returns the notes that changed.
+    # found holds fields already looked up by plan_batch_update, only words missing from it are looked up.
+    found = found or {}
+    if not notes:
+        return []
+    changed = []
+    with lookup_stats.timed("lookup_many"):
+        # Notes of one type share their fields, so group by type to ask for only the fields that exist
+        by_type = {}
+        for note, src_txt in zip(notes, src_txts):
+            by_type.setdefault(note.note_type()["id"], []).append((note, src_txt))
+        for pairs in by_type.values():
+            fields = mw.col.models.field_names(pairs[0][0].note_type())
+            wanted = tuple(setting for setting in DEST_SETTINGS if config.get(setting) in fields)
+            if not dictionaries_ready(wanted):
+                # Left alone rather than filled in from a missing dictionary, see ensure_dictionaries
+                continue
+            looked_up = dict(engine.lookup_many((src_txt for _, src_txt in pairs if src_txt not in found),
+                                                config, wanted))
+            for note, src_txt in pairs:
+                new_fields = found[src_txt] if src_txt in found else looked_up[src_txt]
+                if fill_fields(fields, note, new_fields):
+                    changed.append(note)
+    return changed
+
+
+def store_cache_info(store):
+    # The stores are plain dicts until the dictionaries have loaded
+    return store.cache_info() if isinstance(store, dict_store.DictStore) else {}
+
+
 def insert_if_empty(fields: list, note: Note, dest_config: str, new_text: str):
     if new_text == "":
         return False
     dest_field = config[dest_config]
-    if dest_field in fields:
-        if note[dest_field] == "":
-            note[dest_field] = new_text
+    # Only report a change when something was written, so complete notes aren't saved again
+    if dest_field in fields and note[dest_field] == "":
+        note[dest_field] = new_text
         return True
+    return False
 
 
 def settings_dialog():
@@ -290,6 +311,44 @@ def settings_dialog():
     box_sentc_nums.addWidget(label_sentc_nums)
     box_sentc_nums.addWidget(text_sentc_nums)
 
+    box_ranking = QHBoxLayout()
+    label_ranking = QLabel("Sentence Order:")
+    combo_ranking = QComboBox()
+    combo_ranking.addItems(sentence_examples.RANKINGS)
+    combo_ranking.setMinimumWidth(200)
+    box_ranking.addWidget(label_ranking)
+    box_ranking.addWidget(combo_ranking)
+
+    box_rating_weight = QHBoxLayout()
+    label_rating_weight = QLabel("Rating Weight (%):")
+    text_rating_weight = QSpinBox()
+    text_rating_weight.setRange(0, 100)
+    text_rating_weight.setMinimumWidth(200)
+    box_rating_weight.addWidget(label_rating_weight)
+    box_rating_weight.addWidget(text_rating_weight)
+
+    box_min_rating = QHBoxLayout()
+    label_min_rating = QLabel("Minimum Rating (%):")
+    text_min_rating = QSpinBox()
+    text_min_rating.setRange(0, 100)
+    text_min_rating.setMinimumWidth(200)
+    box_min_rating.addWidget(label_min_rating)
+    box_min_rating.addWidget(text_min_rating)
+
+    box_segment_mode = QHBoxLayout()
+    label_segment_mode = QLabel("Split Sentences:")
+    combo_segment_mode = QComboBox()
+    combo_segment_mode.addItems(segmenter.SEGMENT_MODES)
+    combo_segment_mode.setMinimumWidth(200)
+    box_segment_mode.addWidget(label_segment_mode)
+    box_segment_mode.addWidget(combo_segment_mode)
+
+    box_segment_defs = QHBoxLayout()
+    label_segment_defs = QLabel("Define Each Word:")
+    checkbox_segment_defs = QCheckBox()
+    box_segment_defs.addWidget(label_segment_defs)
+    box_segment_defs.addWidget(checkbox_segment_defs)
+
     ok = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok)
     cancel = QDialogButtonBox(QDialogButtonBox.StandardButton.Cancel)
 
@@ -304,9 +363,15 @@ def settings_dialog():
         text_sentence.setText(config.get(SETTING_SENTENCE_DEST_FIELD, "Examples"))
         text_sentc_nums.setValue(config.get(SETTING_NUM_SENTENCES, 5))
         checkbox_ordered_list.setChecked(config.get(SETTING_USE_ORDERED_LIST, False))
+        combo_ranking.setCurrentText(config.get(SETTING_SENTENCE_RANKING, sentence_examples.RANK_BY_DATE))
+        text_rating_weight.setValue(int(config.get(SETTING_SENTENCE_RATING_WEIGHT, 0.5) * 100))
+        text_min_rating.setValue(config.get(SETTING_SENTENCE_MIN_RATING, 0))
+        combo_segment_mode.setCurrentText(config.get(SETTING_SEGMENT_MODE, segmenter.SEGMENT_OFF))
+        checkbox_segment_defs.setChecked(config.get(SETTING_SEGMENT_DEFINITIONS, False))
 
 
     def save_config():
+        previous = [config.get(setting) for setting in FORMAT_SETTINGS]
         config[SETTING_SRC_FIELD] = text_query.text()
         config[SETTING_FURI_DEST_FIELD] = text_furigana.text()
         config[SETTING_MEANING_FIELD] = text_def.text()
@@ -316,7 +381,17 @@ def settings_dialog():
         config[SETTING_SENTENCE_DEST_FIELD] = text_sentence.text()
         config[SETTING_NUM_SENTENCES] = text_sentc_nums.value()
         config[SETTING_USE_ORDERED_LIST] = checkbox_ordered_list.isChecked()
+        config[SETTING_SENTENCE_RANKING] = combo_ranking.currentText()
+        config[SETTING_SENTENCE_RATING_WEIGHT] = text_rating_weight.value() / 100
+        config[SETTING_SENTENCE_MIN_RATING] = text_min_rating.value()
+        config[SETTING_SEGMENT_MODE] = combo_segment_mode.currentText()
+        config[SETTING_SEGMENT_DEFINITIONS] = checkbox_segment_defs.isChecked()
         mw.addonManager.writeConfig(__name__, config)
+        if previous != [config.get(setting) for setting in FORMAT_SETTINGS]:
+            engine.clear_cache()
+        unload_unused_dictionaries()
+        apply_sentence_ranking()
+        apply_segment_mode()
         dialog.close()
 
 
@@ -333,6 +408,11 @@ def settings_dialog():
         layout.addLayout(box_ordered_list)
         layout.addLayout(box_sentence)
         layout.addLayout(box_sentc_nums)
+        layout.addLayout(box_ranking)
+        layout.addLayout(box_rating_weight)
+        layout.addLayout(box_min_rating)
+        layout.addLayout(box_segment_mode)
+        layout.addLayout(box_segment_defs)
 
         layout.addWidget(ok)
         layout.addWidget(cancel)
@@ -368,29 +448,118 @@ def batch_update_dialog():
     progress_bar.setRange(0, 0)  # Default initial range
     progress_bar.setValue(0)
     progress_bar.setTextVisible(True)
-    progress_bar.setFormat("%v/%m notes updated")
+    progress_bar.setFormat("%v/%m notes processed")
 
     # OK and Cancel buttons
     button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Close)
+    warm = button_box.addButton("Warm Sentence Cache", QDialogButtonBox.ButtonRole.ActionRole)
+
+    # Throughput and cancel state for the running batch
+    status_label = QLabel("")
+    cancel_requested = threading.Event()
+    running = [False]
 
     def on_ok_clicked():
+        if running[0]:
+            return
         selected_note_type = note_type_dropdown.currentText()
         if selected_note_type:
             print(f"Selected Note Type: {selected_note_type}")
             model = mw.col.models.by_name(selected_note_type)
             if model:
-                note_ids = mw.col.db.list(
-                    "SELECT id FROM notes WHERE mid = ?", model["id"]
-                )
-                for idx, note_id in enumerate(note_ids):
-                    note = mw.col.getNote(note_id)
-                    src_field = config.get(SETTING_SRC_FIELD, "")
-                    if src_field in note and note[src_field]:
-                        if update_note(note, note[src_field]):
-                            note.flush()
-                    progress_bar.setValue(idx + 1)
+                if not ensure_dictionaries(model_settings(model)):
+                    showInfo(f"Furigana dictionaries are {load_state}, please try again once they are ready.")
+                    return
+                src_field = config.get(SETTING_SRC_FIELD, "")
+                running[0] = True
+                button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(False)
+                status_label.setText("Checking which notes need updating...")
+
+                def on_planned(plan):
+                    note_ids, found, total = plan
+                    running[0] = False
+                    button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(True)
+                    status_label.setText(f"{len(note_ids):,} of {total:,} notes will change")
+                    if not note_ids:
+                        return
+                    if askUser(f"{len(note_ids):,} of {total:,} notes will change. Update them now?", parent=dialog):
+                        start_update(note_ids, found, src_field)
+
+                QueryOp(
+                    parent=dialog,
+                    op=lambda col: plan_batch_update(col, model, src_field),
+                    success=on_planned
+                ).failure(on_failure).run_in_background()
+
+    def start_update(note_ids, found, src_field):
+        progress_bar.setRange(0, len(note_ids))
+        progress_bar.setValue(0)
+        cancel_requested.clear()
+        running[0] = True
+        button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(False)
+        start = time.perf_counter()
+        totals = {"processed": 0, "updated": 0}
+
+        def on_progress(processed, updated):
+            totals["processed"], totals["updated"] = processed, updated
+            progress_bar.setValue(processed)
+            elapsed = time.perf_counter() - start
+            text = f"{updated} notes changed, {processed / elapsed if elapsed else 0:.0f} notes/s"
+            status_label.setText(text)
+            # The dialog is behind Anki's progress window while the update runs, so show it there too
+            mw.progress.update(label=f"{processed:,} of {len(note_ids):,} notes checked, {text}", value=processed,
+                               max=len(note_ids))
+
+        def on_finished(_changes=None):
+            running[0] = False
+            button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(True)
+            result = "Cancelled" if cancel_requested.is_set() else "Finished"
+            status_label.setText(f"{result}: {totals['updated']} of {totals['processed']} notes changed "
+                                 f"in {time.perf_counter() - start:.1f}s")
+
+        CollectionOp(
+            parent=dialog,
+            op=lambda col: run_batch_update(col, note_ids, src_field, found, cancel_requested,
+                                            lambda processed, updated: mw.taskman.run_on_main(
+                                                lambda: on_progress(processed, updated)))
+        ).success(on_finished).failure(on_failure).run_in_background()
+
+    def on_failure(error):
+        running[0] = False
+        button_box.button(QDialogButtonBox.StandardButton.Ok).setEnabled(True)
+        status_label.setText("")
+        showInfo(f"Batch update failed: {error}")
+
+    def on_warm_clicked():
+        if running[0]:
+            return
+        if not ensure_dictionaries((SETTING_SENTENCE_DEST_FIELD,)):
+            showInfo(f"Example sentences are {load_state}, please try again once they are ready.")
+            return
+        if engine.sentence_cache is None:
+            showInfo("The sentence cache is switched off.")
+            return
+        model = mw.col.models.by_name(note_type_dropdown.currentText())
+        if model:
+            running[0] = True
+            status_label.setText("Searching example sentences for every note...")
+
+            def on_warmed(count):
+                running[0] = False
+                status_label.setText(f"{count:,} words added to the sentence cache")
+
+            QueryOp(
+                parent=dialog,
+                op=lambda col: warm_sentence_cache(col, model, config.get(SETTING_SRC_FIELD, "")),
+                success=on_warmed
+            ).failure(on_failure).run_in_background()
 
     def on_cancel_clicked():
+        if running[0]:
+            # Stops after the chunk being written, everything before it is already saved
+            cancel_requested.set()
+            status_label.setText("Cancelling...")
+            return
         dialog.close()
 
     # Event handler for when the combobox selection changes
@@ -412,25 +581,413 @@ def batch_update_dialog():
     # Connect signals to slots
     note_type_dropdown.currentIndexChanged.connect(on_note_type_changed)
     button_box.accepted.connect(on_ok_clicked)
+    warm.clicked.connect(on_warm_clicked)
     button_box.rejected.connect(on_cancel_clicked)
 
     layout = QVBoxLayout(dialog)
 
     layout.addLayout(dropdown_layout)
     layout.addWidget(progress_bar)
+    layout.addWidget(status_label)
     layout.addWidget(button_box)
 
     dialog.setLayout(layout)
     dialog.exec()
+    # Closing the window mid run shouldn't leave the batch going
+    cancel_requested.set()
+
+
+def stats_dialog():
+    dialog = QDialog(mw)
+    dialog.setWindowTitle("Furigana Lookup Stats")
+
+    text_stats = QPlainTextEdit()
+    text_stats.setReadOnly(True)
+    text_stats.setMinimumSize(560, 400)
+    text_stats.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+
+    checkbox_enabled = QCheckBox("Collect timings")
+    checkbox_enabled.setChecked(lookup_stats.enabled)
+
+    button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+    refresh = button_box.addButton("Refresh", QDialogButtonBox.ButtonRole.ActionRole)
+    reset = button_box.addButton("Reset", QDialogButtonBox.ButtonRole.ResetRole)
+    export = button_box.addButton("Export JSON...", QDialogButtonBox.ButtonRole.ActionRole)
+
+    def on_refresh():
+        text_stats.setPlainText(lookup_stats.format_table())
+
+    def on_reset():
+        lookup_stats.reset()
+        on_refresh()
+
+    def on_export():
+        path, _ = QFileDialog.getSaveFileName(dialog, "Export Lookup Stats", "furigana_stats.json", "JSON (*.json)")
+        if path:
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(lookup_stats.to_dict(), file, indent=2, ensure_ascii=False)
+
+    def on_enabled_changed():
+        lookup_stats.enabled = checkbox_enabled.isChecked()
+        config[SETTING_COLLECT_STATS] = lookup_stats.enabled
+        mw.addonManager.writeConfig(__name__, config)
+        on_refresh()
+
+    qconnect(refresh.clicked, on_refresh)
+    qconnect(reset.clicked, on_reset)
+    qconnect(export.clicked, on_export)
+    qconnect(checkbox_enabled.toggled, on_enabled_changed)
+    qconnect(button_box.rejected, dialog.close)
+
+    layout = QVBoxLayout(dialog)
+    layout.addWidget(text_stats)
+    layout.addWidget(checkbox_enabled)
+    layout.addWidget(button_box)
+    dialog.setLayout(layout)
+    on_refresh()
+    dialog.exec()
+
+
+def plan_batch_update(col, model, src_field):
+    # Reads the raw fields straight from the notes table instead of loading every note, and keeps the notes
+    # with a source and at least one empty destination the lookups have a value for.
+    # Returns (note ids to update, word -> looked up fields for those notes, notes of the type).
+    field_names = col.models.field_names(model)
+    if src_field not in field_names:
+        return [], {}, 0
+    src_index = field_names.index(src_field)
+    dest_indexes = {setting: field_names.index(config.get(setting)) for setting in DEST_SETTINGS
+                    if config.get(setting) in field_names}
+    rows = col.db.all("SELECT id, flds FROM notes WHERE mid = ?", model["id"])
+    candidates = []
+    for note_id, flds in rows:
+        values = flds.split("\x1f")
+        src_txt = values[src_index]
+        if not src_txt:
+            continue
+        empty = [setting for setting, index in dest_indexes.items() if values[index] == ""]
+        if empty:
+            candidates.append((note_id, src_txt, empty))
+    with lookup_stats.timed("batch_plan"):
+        found = dict(engine.lookup_many((src_txt for _, src_txt, _ in candidates), config, tuple(dest_indexes)))
+    note_ids = []
+    used = {}
+    for note_id, src_txt, empty in candidates:
+        if any(setting in found[src_txt] for setting in empty):
+            note_ids.append(note_id)
+            used[src_txt] = found[src_txt]
+    return note_ids, used, len(rows)
+
+
+def warm_sentence_cache(col, model, src_field):
+    # Searches example sentences for every source word of the note type, so later lookups of them,
+    # in this session or the next, come straight from the sentence cache. Returns how many were new.
+    field_names = col.models.field_names(model)
+    if src_field not in field_names:
+        return 0
+    src_index = field_names.index(src_field)
+    words = [flds.split("\x1f")[src_index] for _, flds in col.db.all("SELECT id, flds FROM notes WHERE mid = ?",
+                                                                       model["id"])]
+    return engine.warm_sentences([word for word in words if word], config)
+
+
+def run_batch_update(col, note_ids, src_field, found, cancel_requested, on_progress):
+    # Runs on a background thread. Each chunk is written with a single update_notes call, so it's
+    # one transaction and one undo step, and cancelling never leaves a chunk half written.
+    # CollectionOp puts up Anki's modal progress window, so cancelling from there counts as well as from
+    # the dialog.
+    changes = OpChanges()
+    updated = 0
+    for chunk_start in range(0, len(note_ids), BATCH_CHUNK_SIZE):
+        if cancel_requested.is_set() or mw.progress.want_cancel():
+            break
+        notes = [col.get_note(note_id) for note_id in note_ids[chunk_start:chunk_start + BATCH_CHUNK_SIZE]]
+        notes = [note for note in notes if src_field in note and note[src_field]]
+        notes = apply_lookups(notes, [note[src_field] for note in notes], found)
+        if notes:
+            with lookup_stats.timed("batch_write"):
+                changes = col.update_notes(notes)
+        updated += len(notes)
+        on_progress(min(chunk_start + BATCH_CHUNK_SIZE, len(note_ids)), updated)
+    return changes
 
 
 def init_menu():
+    global load_status_action
     action = QAction("Furigana Addon Settings", mw)
     batch_update = QAction("Furigana Batch Update", mw)
+    stats = QAction("Furigana Lookup Stats", mw)
+    load_status_action = QAction("", mw)
+    load_status_action.setEnabled(False)
     qconnect(action.triggered, settings_dialog)
     qconnect(batch_update.triggered, batch_update_dialog)
+    qconnect(stats.triggered, stats_dialog)
     mw.form.menuTools.addAction(action)
     mw.form.menuTools.addAction(batch_update)
+    mw.form.menuTools.addAction(stats)
+    mw.form.menuTools.addAction(load_status_action)
+    update_load_status()
+
+
+def update_load_status():
+    text = f"Furigana dictionaries: {load_state}"
+    names = [name for name in RESOURCES if name in loaded_resources]
+    if names:
+        text += f" ({', '.join(names)}, {sum(load_times.get(name, 0) for name in names):.1f}s)"
+    if load_status_action is not None:
+        load_status_action.setText(text)
+
+
+def model_settings(model):
+    # Destination settings with a field on the note type, as long as it has the source field too
+    fields = mw.col.models.field_names(model)
+    if config.get(SETTING_SRC_FIELD) not in fields:
+        return ()
+    return tuple(setting for setting in DEST_SETTINGS if config.get(setting) in fields)
+
+
+def wanted_resources():
+    # Every resource a lookup on some note type could need with the current settings
+    if mw.col is None:
+        return set()
+    wanted = set()
+    for model in mw.col.models.all():
+        wanted.update(lookup_engine.needed_resources(model_settings(model), config))
+    return wanted
+
+
+def dictionaries_ready(wanted):
+    return lookup_engine.needed_resources(wanted, config) <= loaded_resources
+
+
+def ensure_dictionaries(wanted):
+    # True when everything looking up wanted needs is loaded, otherwise starts loading what's missing
+    if dictionaries_ready(wanted):
+        return True
+    start_loading_dictionaries(lookup_engine.needed_resources(wanted, config))
+    return False
+
+
+def wait_for_dictionaries(wanted, timeout):
+    # Only blocks when a load is actually in flight, a failed or unstarted load returns straight away
+    if load_state == LOAD_STATE_LOADING:
+        dicts_ready.wait(timeout)
+    return dictionaries_ready(wanted)
+
+
+def load_furigana_index():
+    if compile_dicts.furigana_store_needs_build(dicts_path):
+        compile_dicts.build_furigana_store(dicts_path)
+    return dict_store.DictStore(os.path.join(dicts_path + compile_dicts.FURIGANA_STORE))
+
+
+def load_jmdict():
+    if compile_dicts.jmdict_store_needs_build(dicts_path):
+        # Builds from the XML and saves it for next time. This takes a few seconds.
+        compile_dicts.build_jmdict_store(dicts_path)
+    return dict_store.JmdictStore(os.path.join(dicts_path + compile_dicts.JMDICT_STORE))
+
+
+def load_sentence_lib(ranking, rating_weight):
+    if compile_dicts.sentence_pickle_needs_build(dicts_path):
+        if not compile_dicts.sentence_pickle_can_update(dicts_path):
+            return compile_dicts.build_sentence_lib(dicts_path, ranking, rating_weight)
+        # A newer Tatoeba export was dropped in, only what changed gets re-indexed
+        lib = compile_dicts.update_sentence_lib(dicts_path)
+    else:
+        lib = sentence_examples.JapaneseSentenceLib()
+        lib.load_pickle_file(os.path.join(dicts_path + sentences_pickle_file))
+    if lib.set_ranking(ranking, rating_weight):
+        # Re-sorting the postings takes a moment, so keep the result in the pickle for next time
+        lib.save_pickle_file(os.path.join(dicts_path + sentences_pickle_file))
+    return lib
+
+
+def load_sentence_cache(lib):
+    # Searches are only worth keeping when there's a corpus version to tie them to
+    max_entries = config.get(SETTING_SENTENCE_CACHE_SIZE, 50000)
+    corpus_version = artifacts.header_version(lib.header)
+    if not max_entries or corpus_version is None:
+        return None
+    return result_cache.SentenceResultCache(os.path.join(dicts_path + result_cache.SENTENCE_RESULTS), corpus_version,
+                                            max_entries)
+
+
+def close_sentence_cache():
+    # A lookup or batch still holding the closed cache treats it as empty, see result_cache
+    cache = engine.sentence_cache
+    if cache is not None:
+        engine.set_sentence_cache(None)
+        cache.close()
+
+
+def load_segmenter():
+    return segmenter.Segmenter(lookup_engine.segment_keys(engine.furigana, engine.jmdict))
+
+
+def load_dictionaries(names, ranking, rating_weight, segment_mode=segmenter.SEGMENT_OFF):
+    # Runs on a background thread, nothing in here may touch Qt. Loads the resources in names into the
+    # engine and returns how long each took.
+    timings = {}
+    loaded = {}
+    loaders = {RESOURCE_FURIGANA: load_furigana_index, RESOURCE_JMDICT: load_jmdict,
+               RESOURCE_SENTENCES: lambda: load_sentence_lib(ranking, rating_weight)}
+    for name in RESOURCES:
+        if name in names:
+            start = time.perf_counter()
+            loaded[name] = loaders[name]()
+            timings[name] = time.perf_counter() - start
+    engine.set_resources(loaded.get(RESOURCE_FURIGANA), loaded.get(RESOURCE_JMDICT), loaded.get(RESOURCE_SENTENCES))
+    if RESOURCE_SENTENCES in loaded:
+        close_sentence_cache()
+        engine.set_sentence_cache(load_sentence_cache(loaded[RESOURCE_SENTENCES]))
+    if segment_mode != segmenter.SEGMENT_OFF and engine.segmenter is None and \
+            {RESOURCE_FURIGANA, RESOURCE_JMDICT} <= loaded_resources | set(loaded):
+        start = time.perf_counter()
+        engine.set_segmenter(load_segmenter())
+        timings["Segmenter"] = time.perf_counter() - start
+    return timings
+
+
+def start_loading_dictionaries(needed=None):
+    # Loads the resources in needed that aren't in yet, by default every one some note type could use.
+    # While a load is in flight the new ones are queued and loaded straight after it.
+    requested_resources.update(wanted_resources() if needed is None else needed)
+    if load_state != LOAD_STATE_LOADING:
+        load_missing_dictionaries()
+
+
+def load_missing_dictionaries():
+    global load_state
+    missing = requested_resources - loaded_resources
+    if not missing:
+        return
+    load_state = LOAD_STATE_LOADING
+    dicts_ready.clear()
+    update_load_status()
+
+    def on_done(future):
+        global load_state
+        try:
+            timings = future.result()
+        except Exception as e:
+            load_state = LOAD_STATE_FAILED
+            # Asked again by the next lookup that needs them
+            requested_resources.difference_update(missing)
+            dicts_ready.set()
+            print(f"Failed to load furigana dictionaries: {e}")
+            tooltip("Furigana dictionaries failed to load.")
+            update_load_status()
+            return
+        load_times.update(timings)
+        lookup_stats.load_times.update(timings)
+        loaded_resources.update(missing)
+        for name, seconds in timings.items():
+            print(f"Loaded {name} in {seconds:.2f}s")
+        # In case the settings were changed while loading
+        unload_unused_dictionaries()
+        if requested_resources - loaded_resources:
+            # More were asked for in the meantime, waiting lookups keep waiting for those
+            load_missing_dictionaries()
+            return
+        load_state = LOAD_STATE_READY
+        dicts_ready.set()
+        tooltip(f"Furigana dictionaries ready ({sum(timings.values()):.1f}s)")
+        apply_sentence_ranking()
+        apply_segment_mode()
+        update_load_status()
+
+    mw.taskman.run_in_background(
+        lambda: load_dictionaries(missing, config.get(SETTING_SENTENCE_RANKING, sentence_examples.RANK_BY_DATE),
+                                  config.get(SETTING_SENTENCE_RATING_WEIGHT, 0.5),
+                                  config.get(SETTING_SEGMENT_MODE, segmenter.SEGMENT_OFF)),
+        on_done)
+
+
+def unload_dictionaries(names):
+    # Lets go of the named resources, a lookup that needs one again loads it again
+    global load_state
+    names = set(names) & loaded_resources
+    if not names:
+        return
+    if RESOURCE_SENTENCES in names:
+        close_sentence_cache()
+    if names & {RESOURCE_FURIGANA, RESOURCE_JMDICT}:
+        engine.set_segmenter(None)
+    # The stores close themselves once nothing refers to them, a lookup on a worker may still be using one
+    engine.unload_resources(names)
+    loaded_resources.difference_update(names)
+    requested_resources.difference_update(names)
+    for name in names:
+        load_times.pop(name, None)
+        print(f"Unloaded {name}")
+    if not loaded_resources and load_state != LOAD_STATE_LOADING:
+        load_state = LOAD_STATE_NOT_STARTED
+    update_load_status()
+
+
+def unload_unused_dictionaries():
+    # After the settings change, frees whatever no note type has a field for any more
+    unload_dictionaries(loaded_resources - wanted_resources())
+
+
+def unload_all_dictionaries():
+    # The next profile may use different note types, so it starts from nothing
+    unload_dictionaries(set(loaded_resources))
+
+
+def apply_sentence_ranking():
+    # Re-sorting the postings takes a few seconds, so it's done on a worker with a separate lib while lookups
+    # keep using the current one, and the result is kept in the pickle for next time
+    global sentence_ranking_running
+    if RESOURCE_SENTENCES not in loaded_resources or sentence_ranking_running:
+        # The loader, or the re-sort already running, picks up the new ranking itself
+        return
+    current = engine.sentences
+    reranked = current.with_ranking(config.get(SETTING_SENTENCE_RANKING, sentence_examples.RANK_BY_DATE),
+                                    config.get(SETTING_SENTENCE_RATING_WEIGHT, 0.5))
+    if reranked is None:
+        return
+    sentence_ranking_running = True
+
+    def rerank():
+        reranked.build_index()
+        reranked.save_pickle_file(os.path.join(dicts_path + sentences_pickle_file))
+        return reranked
+
+    def on_done(future):
+        global sentence_ranking_running
+        sentence_ranking_running = False
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Failed to re-sort the example sentences: {e}")
+            return
+        # Unless the sentences were unloaded in the meantime
+        if engine.sentences is current:
+            engine.set_resources(sentences=reranked)
+        # In case the order was changed again while this one ran
+        apply_sentence_ranking()
+
+    mw.taskman.run_in_background(rerank, on_done)
+
+
+def apply_segment_mode():
+    if config.get(SETTING_SEGMENT_MODE, segmenter.SEGMENT_OFF) == segmenter.SEGMENT_OFF:
+        # Frees the key list
+        if engine.segmenter is not None:
+            engine.set_segmenter(None)
+        return
+    if engine.segmenter is None and {RESOURCE_FURIGANA, RESOURCE_JMDICT} <= loaded_resources:
+        # Reading every key takes a few seconds on the full dictionaries. Without both stores in, the loader
+        # builds it once they are.
+        def on_done(future):
+            # Unless it was switched off, or a store unloaded, in the meantime
+            if config.get(SETTING_SEGMENT_MODE, segmenter.SEGMENT_OFF) != segmenter.SEGMENT_OFF and \
+                    {RESOURCE_FURIGANA, RESOURCE_JMDICT} <= loaded_resources:
+                engine.set_segmenter(future.result())
+
+        mw.taskman.run_in_background(load_segmenter, on_done)
 
 
 def get_field_names_array():
@@ -460,48 +1017,14 @@ def editor_button_setup(buttons, editor):
 
 
 # GUI Hooks
+gui_hooks.editor_did_init.append(track_editor)
 gui_hooks.editor_did_unfocus_field.append(on_focus_lost)
 gui_hooks.editor_did_init_buttons.append(editor_button_setup)
-
-# Dictionary Furigana Dictionary
-with open(os.path.join(dicts_path + 'JmdictFurigana.json'), 'r', encoding='utf-8-sig') as f:
-    jmdict_furi_data = json.load(f)
-
-# JMDict Data Load
-data_file = os.path.join(dicts_path + 'dill.pkl') # DIctionary LLoad?
-# Check to see if we already have a file
-if os.path.isfile(data_file):
-    # Open the pickle file and load the data
-    with open(data_file, 'rb') as file:
-        dict_data = pickle.load(file)
-else:
-    # No pickle file found, so we build the array and save for next time. This takes a few seconds.
-    jmdict_data = load_xml_file(os.path.join(dicts_path + 'JMdict_e.xml'))
-    if jmdict_data is not None:
-        print(f"Successfully loaded XML file. Root tag is '{jmdict_data.tag}'.")
-    else:
-        print("Failed to load XML file.")
-    dict_data = build_dict_from_xml(jmdict_data)
-    jmdict_data = None
-    with open(data_file, "wb") as file:
-        pickle.dump(dict_data, file)
-
-# Begin Section for example sentences
-sentences_pickle_file = 'sentences.pickle'
-if os.path.isfile(os.path.join(dicts_path + sentences_pickle_file)):
-    jsl = sentence_examples.JapaneseSentenceLib()
-    jsl.load_pickle_file(os.path.join(dicts_path + sentences_pickle_file))
-else:
-    jsl = sentence_examples.JapaneseSentenceLib()
-    # Won't include these in the release... However... can be downloaded from the following.
-    # https://tatoeba.org/en/downloads
-    jsl.load_sentences_from_file(os.path.join(dicts_path + 'jpn_sentences_detailed.tsv'))
-    jsl.load_sentence_rating_data(os.path.join(dicts_path + 'users_sentences.csv'))
-    jsl.save_pickle_file(os.path.join(dicts_path + sentences_pickle_file))
-
+gui_hooks.profile_will_close.append(unload_all_dictionaries)
 
 # Create config variable
 config = mw.addonManager.getConfig(__name__)
+lookup_stats.enabled = config.get(SETTING_COLLECT_STATS, True)
 
 # Add the options to the menu
 init_menu()
\ No newline at end of file
@@ -0,0 +1,391 @@
+import threading
+from collections import OrderedDict
+
+from .sentence_examples import JapaneseSentenceLib, RANK_BY_DATE
+from .jmdict_xml import parts_of_speech_conversion
+from .result_cache import settings_key
+from .segmenter import SEGMENT_OFF
+from .stats import Stats
+
+# Turns source words into field values, with no Anki in sight so it can be driven in bulk or from a script:
+#
+#   engine = LookupEngine(furigana_store, jmdict_store, sentence_lib)
+#   for word, fields in engine.lookup_many(words, config):
+#       ...
+#
+# options is anything with .get() holding the add-on's config keys, the add-on passes its config straight in.
+
+SETTING_SRC_FIELD = "kanji_field"
+SETTING_FURI_DEST_FIELD = "furigana_field"
+SETTING_KANA_DEST_FIELD = "kana_field"
+SETTING_TYPE_DEST_FIELD = "type_field"
+SETTING_MEANING_FIELD = "definition_field"
+SETTING_NUM_DEFS = "number_of_defs"
+SETTING_NUM_SENTENCES = "number_of_sentences"
+SETTING_SENTENCE_DEST_FIELD = "sentence_field"
+SETTING_USE_ORDERED_LIST = "use_ordered_list"
+SETTING_SENTENCE_RANKING = "sentence_ranking"
+SETTING_SENTENCE_RATING_WEIGHT = "sentence_rating_weight"
+SETTING_SENTENCE_MIN_RATING = "sentence_min_rating"
+SETTING_SEGMENT_MODE = "segment_mode"
+SETTING_SEGMENT_DEFINITIONS = "segment_definitions"
+
+# Destination fields in the order they get filled in
+DEST_SETTINGS = [SETTING_FURI_DEST_FIELD, SETTING_MEANING_FIELD, SETTING_KANA_DEST_FIELD, SETTING_TYPE_DEST_FIELD,
+                 SETTING_SENTENCE_DEST_FIELD]
+# Settings that change what a lookup produces, and what they default to when options leaves them out
+FORMAT_DEFAULTS = {SETTING_NUM_DEFS: 3, SETTING_USE_ORDERED_LIST: False, SETTING_NUM_SENTENCES: 5,
+                   SETTING_SENTENCE_MIN_RATING: 0, SETTING_SENTENCE_RANKING: RANK_BY_DATE,
+                   SETTING_SENTENCE_RATING_WEIGHT: 0.5, SETTING_SEGMENT_MODE: SEGMENT_OFF,
+                   SETTING_SEGMENT_DEFINITIONS: False}
+FORMAT_SETTINGS = list(FORMAT_DEFAULTS)
+
+# Dictionaries a lookup can need, see needed_resources
+RESOURCE_FURIGANA = "JmdictFurigana"
+RESOURCE_JMDICT = "JMdict"
+RESOURCE_SENTENCES = "Tatoeba sentences"
+RESOURCES = [RESOURCE_FURIGANA, RESOURCE_JMDICT, RESOURCE_SENTENCES]
+
+# Number of source words whose looked up fields are kept around
+LOOKUP_CACHE_SIZE = 4096
+# Rendered definitions kept per (entry id, number of defs, ordered list)
+RENDER_CACHE_SIZE = 8192
+# Words fetched from the stores per query in lookup_many
+LOOKUP_BATCH_SIZE = 500
+
+
+def search_furigana_readings(index, target_text):
+    return index.get(target_text, [])
+
+
+def search_furigana(index, target_text):
+    readings = index.get(target_text)
+    if readings:
+        return readings[0]["rendered"]
+    return ""
+
+
+def search_furigana_for_reading(index, target_text, reading):
+    # Homographs such as 今日 (きょう / こんにち) have one entry per reading, this picks the one read as reading
+    # and falls back to the first
+    readings = search_furigana_readings(index, target_text)
+    for found in readings:
+        if found["reading"] == reading:
+            return found["rendered"]
+    return readings[0]["rendered"] if readings else ""
+
+
+def get_senses(dict_item, limit=5, use_ordered_list=False):
+    senses = dict_item["senses"]
+    numbers = [number for number in range(1, limit + 1) if number in senses]
+    if use_ordered_list:
+        return f"<ol>{''.join(f'<li>{senses[number]}</li>' for number in numbers)}</ol>"
+    return "<br>".join(f"{number}. {senses[number]}" for number in numbers)
+
+
+def word_type(dict_item):
+    # Stores built since ENTRY_FORMAT 3 have it worked out already
+    if "pos_ja" in dict_item:
+        return dict_item["pos_ja"]
+    return parts_of_speech_conversion(dict_item.get("parts_of_speech_values", ""))
+
+
+def render_segments(tokens, readings):
+    # Anki's ruby syntax gives a reading to everything back to the last space, so each token that starts
+    # with a reading needs a space in front of it. Text where no token has a reading gives "", so the field
+    # is left empty as it is with segmenting off.
+    output = ""
+    any_reading = False
+    for token, known in tokens:
+        found = readings.get(token) if known else None
+        if found:
+            rendered = found[0]["rendered"]
+            if output and found[0]["furigana"] and "rt" in found[0]["furigana"][0]:
+                output += " "
+            output += rendered
+            any_reading = any_reading or any("rt" in part for part in found[0]["furigana"])
+        else:
+            output += token
+    return output if any_reading else ""
+
+
+def token_definitions(tokens, entries):
+    # The first sense of every distinct word in the text, one per line
+    lines = []
+    for token in dict.fromkeys(token for token, known in tokens if known):
+        entry = entries.get(token)
+        if entry and entry["senses"]:
+            lines.append(f"{token}: {entry['senses'][min(entry['senses'])]}")
+    return "<br>".join(lines)
+
+
+def segment_keys(furigana, jmdict):
+    # Every text the segmenter can match: JmdictFurigana texts, JMdict kebs and JMdict readings
+    keys = set(furigana.keys())
+    keys.update(jmdict.keys())
+    if hasattr(jmdict, "readings"):
+        keys.update(jmdict.readings())
+    else:
+        keys.update(entry.get("reb", "") for entry in jmdict.values())
+    return keys
+
+
+def fetch_many(store, keys):
+    # DictStores answer a whole batch in one query, plain dicts (tests, the old pickles) one key at a time
+    if hasattr(store, "get_many"):
+        return store.get_many(keys)
+    return {key: store[key] for key in keys if key in store}
+
+
+def fetch_entries(store, words):
+    # JMdict entries by keb, falling back to the kana readings for words that aren't a keb
+    entries = fetch_many(store, words)
+    if hasattr(store, "get_many_by_reading"):
+        missing = [word for word in words if word not in entries]
+        if missing:
+            entries.update(store.get_many_by_reading(missing))
+    return entries
+
+
+def needed_resources(wanted, options):
+    # The dictionaries looking up the settings in wanted reads, with these options
+    needed = set()
+    if SETTING_FURI_DEST_FIELD in wanted:
+        needed.add(RESOURCE_FURIGANA)
+    if any(setting in wanted for setting in (SETTING_MEANING_FIELD, SETTING_KANA_DEST_FIELD, SETTING_TYPE_DEST_FIELD)):
+        needed.add(RESOURCE_JMDICT)
+    if SETTING_SENTENCE_DEST_FIELD in wanted:
+        needed.add(RESOURCE_SENTENCES)
+    # The segmenter's keys come from both stores
+    if options.get(SETTING_SEGMENT_MODE, SEGMENT_OFF) != SEGMENT_OFF and (
+            SETTING_FURI_DEST_FIELD in wanted or
+            (options.get(SETTING_SEGMENT_DEFINITIONS, False) and SETTING_MEANING_FIELD in wanted)):
+        needed.update((RESOURCE_FURIGANA, RESOURCE_JMDICT))
+    return needed
+
+
+def format_values(options):
+    return tuple(options.get(setting, default) for setting, default in FORMAT_DEFAULTS.items())
+
+
+class LookupEngine:
+    def __init__(self, furigana=None, jmdict=None, sentences=None, stats=None, cache_size=LOOKUP_CACHE_SIZE):
+        self.stats = stats if stats is not None else Stats(enabled=False)
+        # (word, wanted, format values) -> fields, the editor and background tasks share it
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.render_cache = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.furigana = {}
+        self.jmdict = {}
+        self.sentences = JapaneseSentenceLib()
+        # Only built when segmenting is switched on, see segment_keys
+        self.segmenter = None
+        # Optional result_cache.SentenceResultCache, sentence searches are kept there across sessions
+        self.sentence_cache = None
+        self.set_resources(furigana, jmdict, sentences)
+
+    def set_resources(self, furigana=None, jmdict=None, sentences=None):
+        # None leaves that resource as it was
+        if furigana is not None:
+            self.furigana = furigana
+        if jmdict is not None:
+            self.jmdict = jmdict
+        if sentences is not None:
+            self.sentences = sentences
+        self.clear_cache()
+
+    def unload_resources(self, names):
+        # Swaps the named resources for empty ones so their memory can be freed. Closing the old ones, and
+        # dropping the segmenter and sentence cache that go with them, is up to the caller.
+        if RESOURCE_FURIGANA in names:
+            self.furigana = {}
+        if RESOURCE_JMDICT in names:
+            self.jmdict = {}
+        if RESOURCE_SENTENCES in names:
+            self.sentences = JapaneseSentenceLib()
+        self.clear_cache()
+
+    def set_sentence_cache(self, sentence_cache):
+        # None stops using it, closing the old one is up to the caller
+        self.sentence_cache = sentence_cache
+        self.clear_cache()
+
+    def set_segmenter(self, segmenter):
+        # None switches segmenting off
+        self.segmenter = segmenter
+        self.clear_cache()
+
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+            self.render_cache = {}
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "max_size": self.cache_size}
+
+    def cached(self, word, options, wanted=DEST_SETTINGS):
+        # The fields if word has been looked up with these settings before, None without looking it up
+        wanted = tuple(setting for setting in DEST_SETTINGS if setting in wanted)
+        with self.lock:
+            fields = self.cache.get((word, wanted, format_values(options)))
+            if fields is None:
+                return None
+            self.hits += 1
+            self.cache.move_to_end((word, wanted, format_values(options)))
+        return dict(fields)
+
+    def lookup(self, word, options, wanted=DEST_SETTINGS):
+        for _, fields in self.lookup_many([word], options, wanted):
+            return fields
+
+    def lookup_many(self, words, options, wanted=DEST_SETTINGS, batch_size=LOOKUP_BATCH_SIZE):
+        # Yields (word, {setting: value}) once per distinct word, in the order the words first appear.
+        # Only settings in wanted are looked up and empty values are left out. Words are looked up
+        # batch_size at a time, so results start coming back before a long list is done. Example sentences
+        # are the exception, those for a long list are searched up front in one go, see find_sentences.
+        wanted = tuple(setting for setting in DEST_SETTINGS if setting in wanted)
+        values = format_values(options)
+        unique = list(dict.fromkeys(words))
+        sentences = None
+        if SETTING_SENTENCE_DEST_FIELD in wanted and len(unique) > batch_size:
+            with self.lock:
+                uncached = [word for word in unique if (word, wanted, values) not in self.cache]
+            settings = dict(zip(FORMAT_SETTINGS, values))
+            with self.stats.timed("sentences"):
+                sentences = self.find_sentences(uncached, settings[SETTING_NUM_SENTENCES],
+                                                settings[SETTING_SENTENCE_MIN_RATING] or 0)
+        for batch_start in range(0, len(unique), batch_size):
+            batch = unique[batch_start:batch_start + batch_size]
+            found = {}
+            with self.lock:
+                for word in batch:
+                    fields = self.cache.get((word, wanted, values))
+                    if fields is not None:
+                        self.cache.move_to_end((word, wanted, values))
+                        found[word] = fields
+                self.hits += len(found)
+                self.misses += len(batch) - len(found)
+            missing = [word for word in batch if word not in found]
+            if missing:
+                looked_up = self.compute(missing, wanted, *values, sentences=sentences)
+                with self.lock:
+                    for word, fields in looked_up.items():
+                        self.cache[(word, wanted, values)] = fields
+                        if len(self.cache) > self.cache_size:
+                            self.cache.popitem(last=False)
+                found.update(looked_up)
+            for word in batch:
+                # A copy, so callers can't edit what's cached
+                yield word, dict(found[word])
+
+    def compute(self, words, wanted, num_defs, use_ordered_list, num_sentences, min_rating, ranking, rating_weight,
+                segment_mode, segment_definitions, sentences=None):
+        # ranking and rating_weight are part of the cache key but the sentence lib applies them itself.
+        # sentences holds example sentences already searched for some of the words, by find_sentences.
+        output = {word: {} for word in words}
+        segmenting = segment_mode != SEGMENT_OFF and self.segmenter is not None and (
+            SETTING_FURI_DEST_FIELD in wanted or (segment_definitions and SETTING_MEANING_FIELD in wanted))
+        readings = {}
+        if SETTING_FURI_DEST_FIELD in wanted or segmenting:
+            with self.stats.timed("furigana"):
+                readings = fetch_many(self.furigana, words)
+                for word in words:
+                    rendered = search_furigana(readings, word)
+                    if rendered and SETTING_FURI_DEST_FIELD in wanted:
+                        output[word][SETTING_FURI_DEST_FIELD] = rendered
+        entries = {}
+        if segmenting or any(setting in wanted for setting in (SETTING_MEANING_FIELD, SETTING_KANA_DEST_FIELD,
+                                                               SETTING_TYPE_DEST_FIELD)):
+            with self.stats.timed("jmdict"):
+                entries = fetch_entries(self.jmdict, words)
+            for word, jmdict_info in entries.items():
+                fields = output[word]
+                if SETTING_FURI_DEST_FIELD in wanted and len(readings.get(word, ())) > 1:
+                    # With JMdict looked up anyway, a homograph gets the reading it lists first, the same one
+                    # the kana field gets
+                    fields[SETTING_FURI_DEST_FIELD] = search_furigana_for_reading(readings, word,
+                                                                                  jmdict_info.get("reb", ""))
+                if SETTING_MEANING_FIELD in wanted:
+                    with self.stats.timed("senses"):
+                        fields[SETTING_MEANING_FIELD] = self.render_senses(jmdict_info, num_defs, use_ordered_list)
+                if SETTING_KANA_DEST_FIELD in wanted:
+                    fields[SETTING_KANA_DEST_FIELD] = jmdict_info.get("reb", "")
+                if SETTING_TYPE_DEST_FIELD in wanted:
+                    with self.stats.timed("pos"):
+                        fields[SETTING_TYPE_DEST_FIELD] = word_type(jmdict_info)
+        if segmenting:
+            # Only for text that isn't a word itself, e.g. a sentence or a compound JMdict doesn't list
+            unmatched = [word for word in words if word not in readings and word not in entries]
+            if unmatched:
+                with self.stats.timed("segment"):
+                    self.segment_words(unmatched, output, wanted, segment_mode, segment_definitions)
+        if SETTING_SENTENCE_DEST_FIELD in wanted:
+            with self.stats.timed("sentences"):
+                texts = {word: sentences[word] for word in words if word in sentences} if sentences else {}
+                rest = [word for word in words if word not in texts]
+                if rest:
+                    texts.update(self.find_sentences(rest, num_sentences, min_rating or 0))
+                for word, text in texts.items():
+                    output[word][SETTING_SENTENCE_DEST_FIELD] = text
+        # Keep the fields in DEST_SETTINGS order and drop the empty ones
+        return {word: {setting: fields[setting] for setting in wanted if fields.get(setting)}
+                for word, fields in output.items()}
+
+    def find_sentences(self, words, limit, min_rating):
+        # {word: formatted sentences}, going through the on-disk cache when there is one
+        lib = self.sentences
+        cache = self.sentence_cache
+        # The library's own ranking, it can lag behind the settings while the index is re-sorted
+        settings = settings_key(lib.ranking, lib.rating_weight, min_rating, limit)
+        found = cache.get_many(words, settings) if cache is not None else {}
+        # All the misses at once, so a big batch can be matched in one sweep over the corpus
+        searched = {word: [sentence.id for sentence in sentences] for word, sentences in
+                    lib.find_example_sentences_by_words([word for word in words if word not in found], limit,
+                                                        min_rating).items()}
+        if searched and cache is not None:
+            cache.put_many(searched, settings)
+        found.update(searched)
+        return {word: "<br>".join(lib.sentences[sentence_id].text for sentence_id in ids
+                                  if sentence_id in lib.sentences)
+                for word, ids in found.items()}
+
+    def warm_sentences(self, words, options):
+        # Fills the on-disk sentence cache for a whole vocabulary ahead of time, in one search so the
+        # sentence lib can sweep the corpus once for all of them. Returns how many words weren't cached yet.
+        if self.sentence_cache is None:
+            return 0
+        values = dict(zip(FORMAT_SETTINGS, format_values(options)))
+        limit = values[SETTING_NUM_SENTENCES]
+        min_rating = values[SETTING_SENTENCE_MIN_RATING] or 0
+        misses = self.sentence_cache.misses
+        with self.stats.timed("sentences"):
+            self.find_sentences(list(dict.fromkeys(words)), limit, min_rating)
+        return self.sentence_cache.misses - misses
+
+    def render_senses(self, entry, num_defs, use_ordered_list):
+        # Words sharing an entry, and the same word under a different cache key, only render it once
+        entry_id = entry.get("entry_id")
+        if entry_id is None:
+            return get_senses(entry, num_defs, use_ordered_list)
+        key = (entry_id, num_defs, use_ordered_list)
+        rendered = self.render_cache.get(key)
+        if rendered is None:
+            if len(self.render_cache) >= RENDER_CACHE_SIZE:
+                self.render_cache = {}
+            rendered = self.render_cache[key] = get_senses(entry, num_defs, use_ordered_list)
+        return rendered
+
+    def segment_words(self, words, output, wanted, segment_mode, segment_definitions):
+        segmented = {word: self.segmenter.segment(word, segment_mode) for word in words}
+        tokens = list(dict.fromkeys(token for word_tokens in segmented.values()
+                                    for token, known in word_tokens if known))
+        readings = fetch_many(self.furigana, tokens)
+        entries = fetch_entries(self.jmdict, tokens) if segment_definitions and SETTING_MEANING_FIELD in wanted else {}
+        for word, word_tokens in segmented.items():
+            if SETTING_FURI_DEST_FIELD in wanted:
+                output[word][SETTING_FURI_DEST_FIELD] = render_segments(word_tokens, readings)
+            if entries:
+                output[word][SETTING_MEANING_FIELD] = token_definitions(word_tokens, entries)
@@ -0,0 +1,68 @@
+from collections import deque
+
+# Aho-Corasick automaton: finds which of many words occur in a text in one pass over the text, however many
+# words there are. Used to match a whole deck's vocabulary against the sentence corpus in one sweep.
+#
+#   automaton = Automaton(["食べる", "食べ物", "物"])
+#   automaton.find_in("食べ物を食べる")  ->  {0, 1, 2}, the indexes of the words found
+
+
+class Automaton:
+    def __init__(self, words):
+        self.words = list(words)
+        # State 0 is the root. goto[state] maps a character to the next state, fail[state] is the state for the
+        # longest proper suffix that is also a prefix of some word, and output[state] holds the indexes of every
+        # word ending there, including the ones reached through fail.
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for index, word in enumerate(self.words):
+            if word:
+                self.add(word, index)
+        self.link()
+
+    def add(self, word, index):
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = self.goto[state][char] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] += (index,)
+
+    def link(self):
+        # Breadth first, so a state's fail target is always finished before the state itself
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def find_in(self, text):
+        # Indexes of the words that occur in text, each once however often it occurs
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        root = goto[0]
+        found = set()
+        state = 0
+        for char in text:
+            if state == 0:
+                # Most characters don't start any word, so skip them without leaving the root
+                state = root.get(char, 0)
+            else:
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+# Word -> top sentence ids, kept on disk so searches done in one session are free in the next. Tied to a
+# corpus version (see artifacts.header_version): opening it against a different corpus empties it.
+# Reads only bump the last used counter in memory and new results are committed in batches, it's only a
+# cache so losing the last few to a crash is fine. Once closed it answers every word as a miss and drops new
+# results, so a lookup still holding it when the sentences are unloaded carries on without it.
+
+SENTENCE_RESULTS = 'sentence_results.sqlite'
+
+# New results held in the open transaction before it's committed
+COMMIT_EVERY = 256
+
+
+def settings_key(ranking, rating_weight, min_rating, limit):
+    return f"{ranking}:{rating_weight}:{min_rating}:{limit}"
+
+
+class SentenceResultCache:
+    def __init__(self, path, corpus_version, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # (word, settings) -> clock value from reads not written out yet
+        self.touched = {}
+        self.uncommitted = 0
+        try:
+            self.connection = self.open(corpus_version)
+        except sqlite3.DatabaseError as e:
+            # Not worth keeping a cache that can't be read
+            print(f"Resetting {Path(path).name}: {e}")
+            for suffix in ("", "-wal", "-shm"):
+                Path(path + suffix).unlink(missing_ok=True)
+            self.connection = self.open(corpus_version)
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0]
+
+    def open(self, corpus_version):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (corpus_version TEXT)")
+        connection.execute("CREATE TABLE IF NOT EXISTS results (word TEXT NOT NULL, settings TEXT NOT NULL, "
+                           "ids TEXT NOT NULL, used INTEGER NOT NULL, PRIMARY KEY (word, settings)) WITHOUT ROWID")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        row = connection.execute("SELECT corpus_version FROM meta").fetchone()
+        if row is None or row[0] != corpus_version:
+            connection.execute("DELETE FROM results")
+            connection.execute("DELETE FROM meta")
+            connection.execute("INSERT INTO meta VALUES (?)", (corpus_version,))
+        connection.commit()
+        return connection
+
+    def get_many(self, words, settings):
+        # {word: [sentence id, ...]} for the words that are cached
+        found = {}
+        words = list(dict.fromkeys(words))
+        with self.lock:
+            if self.connection is None:
+                self.misses += len(words)
+                return found
+            for chunk_start in range(0, len(words), 500):
+                chunk = words[chunk_start:chunk_start + 500]
+                rows = self.connection.execute(
+                    f"SELECT word, ids FROM results WHERE settings = ? AND word IN ({','.join('?' * len(chunk))})",
+                    [settings] + chunk).fetchall()
+                for word, ids in rows:
+                    found[word] = [int(sentence_id) for sentence_id in ids.split(',')] if ids else []
+                    self.clock += 1
+                    self.touched[(word, settings)] = self.clock
+            self.hits += len(found)
+            self.misses += len(words) - len(found)
+        return found
+
+    def put_many(self, results, settings):
+        # results is {word: [sentence id, ...]}, evicts the least recently used past max_entries
+        with self.lock:
+            if self.connection is None:
+                return
+            rows = []
+            for word, ids in results.items():
+                self.clock += 1
+                rows.append((word, settings, ','.join(map(str, ids)), self.clock))
+            self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+            self.uncommitted += len(rows)
+            if self.uncommitted >= COMMIT_EVERY:
+                self.commit()
+
+    def commit(self):
+        # Called with the lock held
+        if self.touched:
+            self.connection.executemany("UPDATE results SET used = ? WHERE word = ? AND settings = ?",
+                                        [(used, word, settings) for (word, settings), used in self.touched.items()])
+            self.touched = {}
+        self.connection.execute(
+            "DELETE FROM results WHERE used <= "
+            "(SELECT used FROM results ORDER BY used DESC LIMIT 1 OFFSET ?)", (self.max_entries,))
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def flush(self):
+        with self.lock:
+            if self.connection is not None:
+                self.commit()
+
+    def cache_info(self):
+        with self.lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0] \
+                if self.connection is not None else 0
+        return {"hits": self.hits, "misses": self.misses, "size": size, "max_size": self.max_entries}
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.commit()
+            self.connection.close()
+            self.connection = None
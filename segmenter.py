@@ -0,0 +1,85 @@
+from bisect import bisect_left
+
+# Splits a sentence or compound into dictionary words, so the whole string can get furigana and not just
+# exact matches. The keys are kept as one sorted list rather than a dict per node: walking the trie is
+# narrowing a [lo, hi) range with bisect one character at a time, which stops as soon as no key shares
+# the prefix. Each position costs at most the length of the longest key, so lookups stay linear in the input.
+
+SEGMENT_OFF = "off"
+SEGMENT_GREEDY = "greedy"
+SEGMENT_MIN_COST = "min_cost"
+SEGMENT_MODES = [SEGMENT_OFF, SEGMENT_GREEDY, SEGMENT_MIN_COST]
+
+# Sorts after every character, so prefix + END_CHAR bounds the keys starting with prefix
+END_CHAR = "\U0010ffff"
+
+# Cost of a character no key covers, against 1 for any dictionary word. Above 2 so a word split into
+# two known halves still beats leaving one character unknown.
+UNKNOWN_COST = 3
+
+
+class Segmenter:
+    def __init__(self, keys):
+        self.keys = sorted(set(key for key in keys if key))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def match_lengths(self, text, start):
+        # Lengths of the keys that text has at start, shortest first
+        keys = self.keys
+        lo, hi = 0, len(keys)
+        lengths = []
+        end = start
+        while end < len(text) and lo < hi:
+            end += 1
+            prefix = text[start:end]
+            lo = bisect_left(keys, prefix, lo, hi)
+            hi = bisect_left(keys, prefix + END_CHAR, lo, hi)
+            if lo < hi and keys[lo] == prefix:
+                lengths.append(end - start)
+        return lengths
+
+    def segment(self, text, mode=SEGMENT_MIN_COST):
+        # [(token, known)], unknown characters come back one at a time
+        if mode == SEGMENT_GREEDY:
+            return self.segment_greedy(text)
+        return self.segment_min_cost(text)
+
+    def segment_greedy(self, text):
+        tokens = []
+        i = 0
+        while i < len(text):
+            lengths = self.match_lengths(text, i)
+            if lengths:
+                tokens.append((text[i:i + lengths[-1]], True))
+                i += lengths[-1]
+            else:
+                tokens.append((text[i], False))
+                i += 1
+        return tokens
+
+    def segment_min_cost(self, text):
+        # Fewest words with the fewest unknown characters. Filled from the end, so on a tie the
+        # longer word at the front wins like it would with greedy.
+        n = len(text)
+        cost = [0] * (n + 1)
+        step = [1] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            cost[i] = UNKNOWN_COST + cost[i + 1]
+            step[i] = 1
+            for length in reversed(self.match_lengths(text, i)):
+                if 1 + cost[i + length] < cost[i]:
+                    cost[i] = 1 + cost[i + length]
+                    step[i] = length
+        tokens = []
+        i = 0
+        while i < n:
+            token = text[i:i + step[i]]
+            tokens.append((token, step[i] > 1 or token in self))
+            i += step[i]
+        return tokens
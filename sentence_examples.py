@@ -1,40 +1,445 @@
+import calendar
 import csv
+import io
+import os
 import pickle
-from datetime import datetime
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from . import artifacts
+from .multi_match import Automaton
+
+# Orderings for example sentences, postings are stored pre-sorted in the chosen one
+RANK_BY_DATE = "date"
+RANK_BY_RATING = "rating"
+RANK_WEIGHTED = "weighted"
+RANKINGS = [RANK_BY_DATE, RANK_BY_RATING, RANK_WEIGHTED]
+
+# Bump when the layout written by save_pickle_file changes
+PICKLE_KIND = "sentences"
+PICKLE_FORMAT = 2
+
+# Roughly how many posting entries the per word search checks in the time a sweep takes over one sentence,
+# see find_example_sentences_by_words
+SWEEP_COST_FACTOR = 16
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(date):
+    return calendar.timegm(date.timetuple())
+
+
+def from_epoch(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def parse_date(text):
+    # Tatoeba dates are always 'YYYY-MM-DD HH:MM:SS', slicing them is far quicker than strptime
+    if len(text) == 19 and text[4] == '-' and text[7] == '-' and text[10] == ' ' and text[13] == ':' \
+            and text[16] == ':':
+        date = datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                        int(text[11:13]), int(text[14:16]), int(text[17:19]))
+        return (date - EPOCH) // timedelta(seconds=1)
+    return to_epoch(datetime.strptime(text, '%Y-%m-%d %H:%M:%S'))
+
+
+def parse_row(data):
+    # Turns a row of the TSV into the values Sentence.__getstate__ returns
+    date_added = data[4]
+    date_modified = data[5]
+    # Fixes up the ones without an added date
+    if date_added == '\\N':
+        date_added = date_modified
+    if date_modified == '\\N':
+        date_modified = date_added
+    if date_added in ['0000-00-00 00:00:00', '\\N']:
+        date_added = '2008-01-26 18:04:24'
+    if date_modified in ['0000-00-00 00:00:00', '\\N']:
+        date_modified = '2008-01-26 18:04:24'
+    return (int(data[0]), sys.intern(data[1]), data[2], sys.intern(data[3]), parse_date(date_added),
+            parse_date(date_modified), 0, 0, 0)
+
+
+def line_aligned_chunks(filepath, chunk_count):
+    # Splits the file into byte ranges that each start at the beginning of a line
+    size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, 'rb') as file:
+        for i in range(1, chunk_count):
+            # Step back a byte so a split that lands right on a line start keeps that line
+            file.seek(max(size * i // chunk_count - 1, bounds[-1]))
+            file.readline()
+            bounds.append(file.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def read_chunk_rows(filepath, start, end):
+    with open(filepath, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    return csv.reader(io.StringIO(text, newline=None), delimiter='\t')
+
+
+def parse_sentence_chunk(filepath, start, end):
+    # Runs in a worker process, plain tuples are much cheaper to send back than Sentence objects
+    return [parse_row(line) for line in read_chunk_rows(filepath, start, end)]
+
+
+def count_rating_chunk(filepath, start, end):
+    # Sentence id -> [positive, undecided, negative] for this chunk of users_sentences.csv
+    counts = {}
+    for line in read_chunk_rows(filepath, start, end):
+        if line[2] == '1':
+            counts.setdefault(int(line[1]), [0, 0, 0])[0] += 1
+        elif line[2] == '0':
+            counts.setdefault(int(line[1]), [0, 0, 0])[1] += 1
+        elif line[2] == '-1':
+            counts.setdefault(int(line[1]), [0, 0, 0])[2] += 1
+    return counts
+
+
+def map_chunks(function, filepath, workers):
+    chunks = line_aligned_chunks(filepath, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, [filepath] * len(chunks), *zip(*chunks)))
+
+
+def parse_sentences(filepath, workers=1):
+    # Every row of the TSV as parse_row values, in file order
+    if workers > 1:
+        return [values for rows in map_chunks(parse_sentence_chunk, filepath, workers) for values in rows]
+    return parse_sentence_chunk(filepath, 0, os.path.getsize(filepath))
+
+
+def count_ratings(filepath, workers=1):
+    # Sentence id -> [positive, undecided, negative] for the whole of users_sentences.csv
+    if workers <= 1:
+        return count_rating_chunk(filepath, 0, os.path.getsize(filepath))
+    # Each chunk is counted separately, then the counts are added up
+    totals = {}
+    for counts in map_chunks(count_rating_chunk, filepath, workers):
+        for sentence_id, (positive, undecided, negative) in counts.items():
+            total = totals.setdefault(sentence_id, [0, 0, 0])
+            total[0] += positive
+            total[1] += undecided
+            total[2] += negative
+    return totals
+
+
+def is_pickle_header(data):
+    # Headers are None or a dict with a kind, older pickles start straight with the data
+    return data is None or (isinstance(data, dict) and data.get("kind") == PICKLE_KIND)
+
+
+def read_pickle_header(data_file):
+    with open(data_file, 'rb') as file:
+        data = pickle.load(file)
+    return data if is_pickle_header(data) else None
+
+
+def index_keys(text):
+    keys = set(text)
+    keys.update(text[i:i + 2] for i in range(len(text) - 1))
+    return keys
+
 
 class JapaneseSentenceLib:
     def __init__(self):
         self.sentences = {}
+        # Character / bigram -> ids of the sentences containing it, in ranking order
+        self.postings = None
+        self.ranking = RANK_BY_DATE
+        self.rating_weight = 0.5
+        # Says which format and source files the pickle was built from, see artifacts.py
+        self.header = None
+        # Oldest and newest date_added in epoch seconds, used to scale dates for the weighted ranking.
+        # Worked out when the index is built and kept until the next build, see update_from_files.
+        self.date_range = None
+        # Every sentence id in ranking order for find_example_sentences_by_words, worked out when first needed
+        self.ranked = None
+
+    def set_ranking(self, ranking, rating_weight = 0.5):
+        if ranking not in RANKINGS:
+            ranking = RANK_BY_DATE
+        changed = ranking != self.ranking or (ranking == RANK_WEIGHTED and rating_weight != self.rating_weight)
+        self.ranking = ranking
+        self.rating_weight = rating_weight
+        if changed:
+            self.invalidate_index()
+        return changed
+
+    def with_ranking(self, ranking, rating_weight = 0.5):
+        # A lib sharing this one's sentences but with an index of its own in the new order, so the index can be
+        # rebuilt while this one keeps answering lookups. None when the order wouldn't change.
+        lib = JapaneseSentenceLib()
+        lib.sentences = self.sentences
+        lib.header = self.header
+        lib.ranking = self.ranking
+        lib.rating_weight = self.rating_weight
+        if not lib.set_ranking(ranking, rating_weight):
+            return None
+        return lib
+
+    def invalidate_index(self):
+        self.postings = None
+        self.date_range = None
+        self.ranked = None
+
+    def rank_key(self, sentence):
+        # Smaller sorts first. Ties fall back to date and then id, so every sentence has a place of its own
+        # in a posting that a bisect can find
+        if self.ranking == RANK_BY_RATING:
+            return -sentence.get_rating_percentage(), sentence.added, sentence.id
+        if self.ranking == RANK_WEIGHTED:
+            oldest, newest = self.date_range
+            date_score = 1 - (sentence.added - oldest) / ((newest - oldest) or 1)
+            rating_score = sentence.get_rating_percentage() / 100
+            return (-(self.rating_weight * rating_score + (1 - self.rating_weight) * date_score), sentence.added,
+                    sentence.id)
+        return sentence.added, sentence.id
+
+    def update_date_range(self):
+        if self.sentences:
+            dates = [sentence.added for sentence in self.sentences.values()]
+            self.date_range = (min(dates), max(dates))
+
+    def ranked_ids(self):
+        if self.date_range is None:
+            self.update_date_range()
+        return sorted(self.sentences, key=lambda sentence_id: self.rank_key(self.sentences[sentence_id]))
 
     # Data locations...
     # Sentence id [tab] Lang [tab] Text [tab] Username [tab] Date added [tab] Date last modified
-    def load_sentences_from_file(self, filepath):
-        with open(filepath, 'r') as file:
+    def load_sentences_from_file(self, filepath, workers=1):
+        if workers > 1:
+            self.load_sentences_from_file_parallel(filepath, workers)
+            return
+        with open(filepath, 'r', encoding='utf-8') as file:
             reader = csv.reader(file, delimiter='\t')
             for line in reader:
                 add_sentence = Sentence(line)
-                self.sentences[int(add_sentence.id)] = add_sentence
+                self.sentences[add_sentence.id] = add_sentence
+        self.invalidate_index()
+
+    def load_sentences_from_file_parallel(self, filepath, workers):
+        # Chunks come back in file order, so the result is the same as the serial loader
+        langs = {}
+        usernames = {}
+        for rows in map_chunks(parse_sentence_chunk, filepath, workers):
+            for values in rows:
+                # Interning in the workers is lost on the way back
+                lang = langs.setdefault(values[1], sys.intern(values[1]))
+                username = usernames.setdefault(values[3], sys.intern(values[3]))
+                self.sentences[values[0]] = Sentence.from_values((values[0], lang, values[2], username) + values[4:])
+        self.invalidate_index()
+
+    def build_index(self):
+        self.update_date_range()
+        postings = {}
+        for sentence_id in self.ranked_ids():
+            for key in index_keys(self.sentences[sentence_id].text):
+                postings.setdefault(key, array('i')).append(sentence_id)
+        self.postings = postings
 
-    def find_example_sentences_by_word(self, word, limit = 10):
+    def find_position(self, posting, key, rank_keys):
+        # bisect_left over a posting by rank_key, written out as bisect only takes key= from Python 3.10.
+        # rank_keys caches sentence id -> rank_key across calls.
+        lo, hi = 0, len(posting)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sentence_id = posting[mid]
+            mid_key = rank_keys.get(sentence_id)
+            if mid_key is None:
+                mid_key = rank_keys[sentence_id] = self.rank_key(self.sentences[sentence_id])
+            if mid_key < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index_sentence(self, sentence, rank_keys):
+        key = rank_keys[sentence.id] = self.rank_key(sentence)
+        for index_key in index_keys(sentence.text):
+            posting = self.postings.get(index_key)
+            if posting is None:
+                self.postings[index_key] = array('i', [sentence.id])
+            else:
+                posting.insert(self.find_position(posting, key, rank_keys), sentence.id)
+
+    def unindex_sentence(self, sentence, rank_keys):
+        # The sentence must still be in self.sentences as it was indexed. Its cached key is dropped as
+        # whatever replaces it will rank differently.
+        key = self.rank_key(sentence)
+        for index_key in index_keys(sentence.text):
+            posting = self.postings.get(index_key)
+            if posting is None:
+                continue
+            i = self.find_position(posting, key, rank_keys)
+            if i < len(posting) and posting[i] == sentence.id:
+                del posting[i]
+            if not posting:
+                del self.postings[index_key]
+        rank_keys.pop(sentence.id, None)
+
+    def update_from_files(self, sentences_file, ratings_file, workers=1):
+        # Brings the corpus up to date with a newer Tatoeba export without rebuilding the index. Sentences
+        # are diffed by id and date_modified, ratings are recounted, and only the sentences that changed
+        # are taken out of and put back into the postings. Reading the files is still a full pass, the
+        # index work is proportional to the change.
+        # date_range is left alone so every other sentence keeps its place, the next full build picks
+        # up the new one. Returns how many sentences were added, modified, removed and re-rated.
+        indexed = self.postings is not None
+        counts = {"added": 0, "modified": 0, "removed": 0, "rerated": 0}
+        rank_keys = {}
+        seen = set()
+        for values in parse_sentences(sentences_file, workers):
+            sentence_id = values[0]
+            seen.add(sentence_id)
+            old = self.sentences.get(sentence_id)
+            if old is not None and old.modified == values[5] and old.text == values[2]:
+                continue
+            sentence = Sentence.from_values((sentence_id, sys.intern(values[1]), values[2], sys.intern(values[3]))
+                                            + values[4:])
+            if old is None:
+                counts["added"] += 1
+            else:
+                counts["modified"] += 1
+                sentence.total_ratings = old.total_ratings
+                sentence.positive_rating = old.positive_rating
+                sentence.negative_rating = old.negative_rating
+                if indexed:
+                    self.unindex_sentence(old, rank_keys)
+            self.sentences[sentence_id] = sentence
+            if indexed:
+                self.index_sentence(sentence, rank_keys)
+        for sentence_id in [sentence_id for sentence_id in self.sentences if sentence_id not in seen]:
+            if indexed:
+                self.unindex_sentence(self.sentences[sentence_id], rank_keys)
+            del self.sentences[sentence_id]
+            counts["removed"] += 1
+
+        # Ratings only move sentences around when the ranking uses them
+        reposition = indexed and self.ranking != RANK_BY_DATE
+        totals = count_ratings(ratings_file, workers)
+        for sentence in self.sentences.values():
+            positive, undecided, negative = totals.get(sentence.id, (0, 0, 0))
+            total = positive + undecided + negative
+            if (sentence.positive_rating, sentence.negative_rating, sentence.total_ratings) == (positive, negative,
+                                                                                                  total):
+                continue
+            counts["rerated"] += 1
+            if reposition:
+                self.unindex_sentence(sentence, rank_keys)
+            sentence.positive_rating = positive
+            sentence.negative_rating = negative
+            sentence.total_ratings = total
+            if reposition:
+                self.index_sentence(sentence, rank_keys)
+        if not indexed:
+            self.date_range = None
+        self.ranked = None
+        return counts
+
+    def find_example_sentences_by_word(self, word, limit = 10, min_rating = 0):
+        if self.postings is None:
+            self.build_index()
+        if len(word) == 1:
+            candidates = self.postings.get(word, [])
+        elif word:
+            # The substring check below covers the other bigrams, so the shortest posting is enough
+            # and the walk can stop as soon as it has enough sentences
+            candidates = min((self.postings.get(word[i:i + 2], []) for i in range(len(word) - 1)), key=len)
+        else:
+            candidates = self.ranked_ids()
+        sentences = []
+        if limit <= 0:
+            return sentences
+        for sentence_id in candidates:
+            sentence = self.sentences[sentence_id]
+            if word in sentence.text and (min_rating <= 0 or sentence.get_rating_percentage() >= min_rating):
+                sentences.append(sentence)
+                if len(sentences) == limit:
+                    break
+        return sentences
+
+    def find_example_sentences_by_words(self, words, limit = 10, min_rating = 0):
+        # {word: sentences} for many words at once, the same as find_example_sentences_by_word for each.
+        # Searching word by word walks up to the shortest posting of every word, so for a deck's worth of
+        # common words it's cheaper to sweep the corpus once in ranking order with an Aho-Corasick automaton
+        # over all of them, stopping once every word has its limit. Whichever should check less is used.
+        words = list(dict.fromkeys(words))
+        if self.postings is None:
+            self.build_index()
+        if limit <= 0:
+            return {word: [] for word in words}
+        posting_cost = 0
+        for word in words:
+            if len(word) <= 2:
+                # The posting holds exactly the sentences with the word, so the walk stops after limit of them
+                # unless min_rating turns some away
+                posting = self.postings.get(word, ()) if word else self.sentences
+                posting_cost += len(posting) if min_rating > 0 else min(len(posting), limit)
+            else:
+                posting_cost += min(len(self.postings.get(word[i:i + 2], ())) for i in range(len(word) - 1))
+        if len(words) < 2 or posting_cost <= SWEEP_COST_FACTOR * len(self.sentences):
+            return {word: self.find_example_sentences_by_word(word, limit, min_rating) for word in words}
+        return self.sweep_example_sentences(words, limit, min_rating)
+
+    def sweep_example_sentences(self, words, limit = 10, min_rating = 0):
+        # The single pass behind find_example_sentences_by_words
+        if self.ranked is None:
+            self.ranked = self.ranked_ids()
+        found = {word: [] for word in words}
+        # The empty word matches everything, the automaton leaves it out
+        automaton = Automaton(words)
+        results = [found[word] for word in automaton.words]
+        remaining = sum(1 for word in words if word)
+        if "" in found:
+            found[""] = self.find_example_sentences_by_word("", limit, min_rating)
+        for sentence_id in self.ranked:
+            sentence = self.sentences[sentence_id]
+            if min_rating > 0 and sentence.get_rating_percentage() < min_rating:
+                continue
+            for index in automaton.find_in(sentence.text):
+                sentences = results[index]
+                if len(sentences) < limit:
+                    sentences.append(sentence)
+                    if len(sentences) == limit:
+                        remaining -= 1
+            if not remaining:
+                break
+        return found
+
+    # Brute force version of find_example_sentences_by_word, kept around for checking the index against
+    def find_example_sentences_by_word_scan(self, word, limit = 10, min_rating = 0):
         sentences = []
         for sentence in self.sentences.values():
-            if word in sentence.text:
+            if word in sentence.text and (min_rating <= 0 or sentence.get_rating_percentage() >= min_rating):
                 sentences.append(sentence)
 
-        sentences = sorted(sentences, key=lambda x: x.date_added)
+        if self.date_range is None:
+            self.update_date_range()
+        sentences = sorted(sentences, key=self.rank_key)
         if len(sentences) > limit:
             return sentences[:limit]
         return sentences
 
-    def find_example_sentences_by_word_formatted(self, word, limit = 10):
-        sentences = self.find_example_sentences_by_word(word, limit)
+    def find_example_sentences_by_word_formatted(self, word, limit = 10, min_rating = 0):
+        sentences = self.find_example_sentences_by_word(word, limit, min_rating)
         output_str_ary = []
         for sentence in sentences:
             output_str_ary.append(sentence.text)
         return "<br>".join(output_str_ary)
 
-    def load_sentence_rating_data(self, file):
-        with open(file, 'r') as file:
+    def load_sentence_rating_data(self, file, workers=1):
+        if workers > 1:
+            self.load_sentence_rating_data_parallel(file, workers)
+            return
+        with open(file, 'r', encoding='utf-8') as file:
             reader = csv.reader(file, delimiter='\t')
             for line in reader:
                 sentence = self.get_sentence_by_id(line[1])
@@ -45,42 +450,123 @@ class JapaneseSentenceLib:
                         sentence.add_undecided_rating()
                     elif line[2] == '-1':
                         sentence.add_negative_rating()
+        # Ratings change the order of the postings
+        self.invalidate_index()
+
+    def load_sentence_rating_data_parallel(self, file, workers):
+        for sentence_id, (positive, undecided, negative) in count_ratings(file, workers).items():
+            sentence = self.sentences.get(sentence_id)
+            if sentence:
+                sentence.positive_rating += positive
+                sentence.negative_rating += negative
+                sentence.total_ratings += positive + undecided + negative
+        self.invalidate_index()
 
     def get_sentence_by_id(self, id):
         if int(id) in self.sentences:
             return self.sentences[int(id)]
         return None
 
-    def save_pickle_file(self, data_file):
-        with open(data_file, 'wb') as file:
-            pickle.dump(self.sentences, file)
+    def to_columns(self):
+        # One list/array per attribute pickles and unpickles far quicker than an object per sentence
+        sentences = list(self.sentences.values())
+        return {"id": array('i', [sentence.id for sentence in sentences]),
+                "lang": [sentence.lang for sentence in sentences],
+                "text": [sentence.text for sentence in sentences],
+                "username": [sentence.username for sentence in sentences],
+                "added": array('q', [sentence.added for sentence in sentences]),
+                "modified": array('q', [sentence.modified for sentence in sentences]),
+                "total_ratings": array('i', [sentence.total_ratings for sentence in sentences]),
+                "positive_rating": array('i', [sentence.positive_rating for sentence in sentences]),
+                "negative_rating": array('i', [sentence.negative_rating for sentence in sentences])}
+
+    def from_columns(self, columns):
+        # Usernames and langs repeat a lot, interning them keeps a single copy of each
+        langs = {lang: sys.intern(lang) for lang in set(columns["lang"])}
+        usernames = {username: sys.intern(username) for username in set(columns["username"])}
+        self.sentences = {values[0]: Sentence.from_values((values[0], langs[values[1]], values[2],
+                                                           usernames[values[3]]) + values[4:])
+                          for values in zip(columns["id"], columns["lang"], columns["text"], columns["username"],
+                                            columns["added"], columns["modified"], columns["total_ratings"],
+                                            columns["positive_rating"], columns["negative_rating"])}
+
+    def save_pickle_file(self, data_file, header=None):
+        # The header goes first so it can be checked without unpickling the whole corpus
+        if header is not None:
+            self.header = header
+        if self.postings is None:
+            self.build_index()
+        data = {"columns": self.to_columns(), "postings": self.postings, "ranking": self.ranking,
+                "rating_weight": self.rating_weight, "date_range": self.date_range}
+
+        def write(tmp_file):
+            with open(tmp_file, 'wb') as file:
+                pickle.dump(self.header, file)
+                pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Written next to the real file and swapped in, so a half written pickle is never loaded
+        artifacts.atomic_write(data_file, write)
 
     def load_pickle_file(self, data_file):
         with open(data_file, 'rb') as file:
-            self.sentences = pickle.load(file)
+            data = pickle.load(file)
+            if is_pickle_header(data):
+                self.header = data
+                data = pickle.load(file)
+            else:
+                self.header = None
+        if "columns" in data:
+            self.from_columns(data["columns"])
+            self.postings = data["postings"]
+            self.ranking = data["ranking"]
+            self.rating_weight = data["rating_weight"]
+            self.date_range = data["date_range"]
+            self.ranked = None
+        else:
+            # Older pickles hold Sentence objects, maybe with an index ranked by datetimes, so that gets rebuilt
+            if "sentences" in data:
+                self.ranking = data.get("ranking", RANK_BY_DATE)
+                self.rating_weight = data.get("rating_weight", 0.5)
+                data = data["sentences"]
+            self.sentences = data
+            self.invalidate_index()
+
 
 class Sentence:
+    # Hundreds of thousands of these get loaded, so no per-instance __dict__ and dates are kept as epoch seconds
+    __slots__ = ('id', 'lang', 'text', 'username', 'added', 'modified',
+                 'total_ratings', 'positive_rating', 'negative_rating')
+
     def __init__(self, data):
-        self.id = data[0]
-        self.lang = data[1]
-        self.text = data[2]
-        self.username = data[3]
-        self.date_added = data[4]
-        self.date_modified = data[5]
-        # Fixes up the ones without an added date
-        if self.date_added == '\\N':
-            self.date_added = self.date_modified
-        if self.date_modified == '\\N':
-            self.date_modified = self.date_added
-        if self.date_added in ['0000-00-00 00:00:00', '\\N']:
-            self.date_added = '2008-01-26 18:04:24'
-        if self.date_modified in ['0000-00-00 00:00:00', '\\N']:
-            self.date_modified = '2008-01-26 18:04:24'
-        self.date_modified = datetime.strptime(self.date_modified, '%Y-%m-%d %H:%M:%S')
-        self.date_added = datetime.strptime(self.date_added, '%Y-%m-%d %H:%M:%S')
-        self.total_ratings = 0
-        self.positive_rating = 0
-        self.negative_rating = 0
+        self.__setstate__(parse_row(data))
+
+    @classmethod
+    def from_values(cls, values):
+        # values is the tuple from __getstate__
+        sentence = cls.__new__(cls)
+        sentence.__setstate__(values)
+        return sentence
+
+    def __getstate__(self):
+        return (self.id, self.lang, self.text, self.username, self.added, self.modified,
+                self.total_ratings, self.positive_rating, self.negative_rating)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickles from before __slots__ hold the attribute dict with datetimes and a string id
+            state = (int(state['id']), state['lang'], state['text'], state['username'],
+                     to_epoch(state['date_added']), to_epoch(state['date_modified']),
+                     state['total_ratings'], state['positive_rating'], state['negative_rating'])
+        (self.id, self.lang, self.text, self.username, self.added, self.modified,
+         self.total_ratings, self.positive_rating, self.negative_rating) = state
+
+    @property
+    def date_added(self):
+        return from_epoch(self.added)
+
+    @property
+    def date_modified(self):
+        return from_epoch(self.modified)
 
     def add_positive_rating(self):
         self.positive_rating = self.positive_rating + 1
@@ -96,4 +582,4 @@ class Sentence:
     def get_rating_percentage(self):
         if self.total_ratings == 0:
             return 100
-        return self.positive_rating / self.total_ratings * 100
\ No newline at end of file
+        return self.positive_rating / self.total_ratings * 100
@@ -0,0 +1,121 @@
+import contextlib
+import time
+
+# Per-stage latency histograms for the lookups, so "tabbing off the field lags" comes with numbers.
+# When switched off timed() hands back a shared do-nothing context, so the cost is one attribute check.
+
+# Bucket i holds calls that took under 2**i microseconds (and at least 2**(i-1)), the last one catches the rest
+BUCKET_COUNT = 28
+
+
+class Histogram:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKET_COUNT - 1)] += 1
+
+    def percentile(self, fraction):
+        # Upper edge of the bucket the percentile falls in, good to within a factor of two
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count, "total_s": self.total,
+                "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+                "p50_ms": self.percentile(0.5) * 1e3, "p95_ms": self.percentile(0.95) * 1e3,
+                "p99_ms": self.percentile(0.99) * 1e3, "max_ms": self.max * 1e3,
+                "buckets_us": {f"<{1 << i}": count for i, count in enumerate(self.buckets) if count}}
+
+
+class Timer:
+    __slots__ = ('stats', 'stage', 'start')
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+NULL_TIMER = contextlib.nullcontext()
+
+
+class Stats:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        # Seconds taken to load each dictionary, kept even when timing is off
+        self.load_times = {}
+        # name -> function returning {"hits": ..., "misses": ...}
+        self.counter_sources = {}
+
+    def timed(self, stage):
+        return Timer(self, stage) if self.enabled else NULL_TIMER
+
+    def record(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.add(seconds)
+
+    def add_counter_source(self, name, source):
+        self.counter_sources[name] = source
+
+    def reset(self):
+        self.stages = {}
+
+    def caches(self):
+        output = {}
+        for name, source in self.counter_sources.items():
+            counters = dict(source())
+            lookups = counters.get("hits", 0) + counters.get("misses", 0)
+            counters["hit_rate"] = counters.get("hits", 0) / lookups if lookups else 0.0
+            output[name] = counters
+        return output
+
+    def to_dict(self):
+        return {"enabled": self.enabled, "load_times_s": dict(self.load_times),
+                "stages": {stage: histogram.to_dict() for stage, histogram in self.stages.items()},
+                "caches": self.caches()}
+
+    def format_table(self):
+        lines = [f"{'stage':<16}{'calls':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for stage, histogram in self.stages.items():
+            row = histogram.to_dict()
+            lines.append(f"{stage:<16}{row['count']:>8}{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}"
+                         f"{row['p95_ms']:>10.2f}{row['max_ms']:>10.2f}")
+        if not self.enabled:
+            lines.append("(timing is switched off)")
+        lines.append("")
+        lines.append(f"{'cache':<16}{'hits':>8}{'misses':>10}{'hit rate':>10}")
+        for name, counters in self.caches().items():
+            lines.append(f"{name:<16}{counters.get('hits', 0):>8}{counters.get('misses', 0):>10}"
+                         f"{counters['hit_rate']:>10.1%}")
+        lines.append("")
+        lines.append("dictionary load times")
+        for name, seconds in self.load_times.items():
+            lines.append(f"  {name:<22}{seconds:>8.2f}s")
+        return "\n".join(lines)
@@ -0,0 +1,12 @@
+import os
+import sys
+import types
+
+# The add-on's modules are imported as the anki_furigana package, for their relative imports, without running
+# its __init__. The synthetic Tatoeba export comes from benchmarks/fixtures.py.
+REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(REPO_PATH, "benchmarks"))
+if "anki_furigana" not in sys.modules:
+    package = types.ModuleType("anki_furigana")
+    package.__path__ = [REPO_PATH]
+    sys.modules["anki_furigana"] = package
@@ -0,0 +1,19 @@
+import random
+
+from anki_furigana.multi_match import Automaton
+
+
+def test_overlapping_and_nested_words():
+    automaton = Automaton(["he", "she", "his", "hers", "", "s"])
+    assert automaton.find_in("ushers") == {0, 1, 3, 5}
+    assert automaton.find_in("xyz") == set()
+
+
+def test_matches_substring_check():
+    rng = random.Random(0)
+    alphabet = "あいうえお日本"
+    words = list({"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(200)})
+    automaton = Automaton(words)
+    for _ in range(300):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert automaton.find_in(text) == {index for index, word in enumerate(words) if word in text}, text
@@ -0,0 +1,158 @@
+import random
+
+import pytest
+
+import fixtures
+from anki_furigana import sentence_examples
+from anki_furigana.sentence_examples import JapaneseSentenceLib, RANKINGS, index_keys
+
+# The index, the incremental update and the parallel loaders all promise the same answers as the simple
+# versions, checked here on a small synthetic Tatoeba export.
+
+SENTENCES = 3000
+RATINGS = 6000
+
+
+@pytest.fixture(scope="module")
+def vocabulary():
+    return fixtures.make_vocabulary(400)
+
+
+@pytest.fixture(scope="module")
+def export(tmp_path_factory, vocabulary):
+    path = tmp_path_factory.mktemp("tatoeba")
+    sentences_file = str(path / "jpn_sentences_detailed.tsv")
+    ratings_file = str(path / "users_sentences.csv")
+    fixtures.write_sentences(sentences_file, vocabulary, SENTENCES)
+    fixtures.write_ratings(ratings_file, SENTENCES, RATINGS)
+    return sentences_file, ratings_file
+
+
+def load_lib(sentences_file, ratings_file, ranking=sentence_examples.RANK_BY_DATE, workers=1):
+    lib = JapaneseSentenceLib()
+    lib.load_sentences_from_file(sentences_file, workers)
+    lib.load_sentence_rating_data(ratings_file, workers)
+    lib.set_ranking(ranking, 0.3)
+    lib.build_index()
+    return lib
+
+
+def query_words(vocabulary):
+    words = [keb or reb for keb, reb, _ in random.Random(1).sample(vocabulary, 150)]
+    return words + ["", "は", "です", "ですか。", "見つからない"]
+
+
+def ids(sentences):
+    return [sentence.id for sentence in sentences]
+
+
+def sentence_state(lib):
+    return {sentence_id: sentence.__getstate__() for sentence_id, sentence in lib.sentences.items()}
+
+
+def check_postings(lib):
+    # Every posting holds exactly the sentences with that key, in ranking order
+    expected = {}
+    for sentence_id in lib.ranked_ids():
+        for key in index_keys(lib.sentences[sentence_id].text):
+            expected.setdefault(key, []).append(sentence_id)
+    assert {key: list(posting) for key, posting in lib.postings.items()} == expected
+
+
+def write_newer_export(sentences_file, newer_file, seed=0):
+    # Drops, edits and adds sentences the way a later Tatoeba export would
+    rng = random.Random(seed)
+    with open(sentences_file, encoding="utf-8") as file:
+        rows = [line.rstrip("\n").split("\t") for line in file]
+    output = []
+    for row in rows:
+        roll = rng.random()
+        if roll < 0.05:
+            continue
+        if roll < 0.1:
+            row[2] = row[2][::-1]
+            row[5] = "2024-01-01 00:00:00"
+        output.append(row)
+    next_id = SENTENCES + 1
+    for row in rng.sample(rows, 200):
+        output.append([str(next_id), "jpn", row[2] + "よ", "newuser", "2024-02-02 12:00:00", "\\N"])
+        next_id += 1
+    with open(newer_file, "w", encoding="utf-8") as file:
+        file.writelines("\t".join(row) + "\n" for row in output)
+
+
+@pytest.mark.parametrize("ranking", RANKINGS)
+def test_postings_sorted_and_complete(export, ranking):
+    check_postings(load_lib(*export, ranking))
+
+
+@pytest.mark.parametrize("ranking", RANKINGS)
+@pytest.mark.parametrize("min_rating", [0, 50])
+def test_index_matches_scan(export, vocabulary, ranking, min_rating):
+    lib = load_lib(*export, ranking)
+    for word in query_words(vocabulary):
+        assert ids(lib.find_example_sentences_by_word(word, 5, min_rating)) == \
+               ids(lib.find_example_sentences_by_word_scan(word, 5, min_rating)), word
+
+
+def test_parallel_loaders_match_serial(export):
+    serial = load_lib(*export)
+    parallel = load_lib(*export, workers=2)
+    assert list(parallel.sentences) == list(serial.sentences)
+    assert sentence_state(parallel) == sentence_state(serial)
+
+
+def test_pickle_round_trip(export, tmp_path):
+    lib = load_lib(*export, sentence_examples.RANK_WEIGHTED)
+    pickle_file = str(tmp_path / "sentences.pickle")
+    lib.save_pickle_file(pickle_file, {"kind": sentence_examples.PICKLE_KIND})
+    loaded = JapaneseSentenceLib()
+    loaded.load_pickle_file(pickle_file)
+    assert sentence_state(loaded) == sentence_state(lib)
+    assert loaded.postings == lib.postings
+    assert (loaded.ranking, loaded.rating_weight, loaded.date_range) == (lib.ranking, lib.rating_weight,
+                                                                         lib.date_range)
+
+
+@pytest.mark.parametrize("ranking", RANKINGS)
+def test_update_from_files_matches_rebuild(export, vocabulary, tmp_path, ranking):
+    sentences_file, ratings_file = export
+    newer_sentences = str(tmp_path / "jpn_sentences_detailed.tsv")
+    newer_ratings = str(tmp_path / "users_sentences.csv")
+    write_newer_export(sentences_file, newer_sentences)
+    fixtures.write_ratings(newer_ratings, SENTENCES + 200, RATINGS, seed=1)
+
+    updated = load_lib(sentences_file, ratings_file, ranking)
+    counts = updated.update_from_files(newer_sentences, newer_ratings)
+    assert counts["added"] == 200 and counts["removed"] and counts["modified"] and counts["rerated"]
+
+    rebuilt = load_lib(newer_sentences, newer_ratings, ranking)
+    assert sorted(updated.sentences) == sorted(rebuilt.sentences)
+    assert sentence_state(updated) == sentence_state(rebuilt)
+    # The update keeps the old date_range, so everything ranks as a rebuild with that range would
+    check_postings(updated)
+    for word in query_words(vocabulary):
+        assert ids(updated.find_example_sentences_by_word(word, 5)) == \
+               ids(updated.find_example_sentences_by_word_scan(word, 5)), word
+
+
+@pytest.mark.parametrize("ranking", RANKINGS)
+@pytest.mark.parametrize("min_rating", [0, 50])
+def test_sweep_matches_index(export, vocabulary, ranking, min_rating):
+    lib = load_lib(*export, ranking)
+    words = query_words(vocabulary)
+    swept = lib.sweep_example_sentences(words, 5, min_rating)
+    for word in words:
+        assert ids(swept[word]) == ids(lib.find_example_sentences_by_word(word, 5, min_rating)), word
+
+
+@pytest.mark.parametrize("sweep_cost_factor", [0, 10 ** 9])
+def test_find_by_words_matches_each_word(export, vocabulary, monkeypatch, sweep_cost_factor):
+    # 0 always sweeps, a huge factor always searches word by word
+    monkeypatch.setattr(sentence_examples, "SWEEP_COST_FACTOR", sweep_cost_factor)
+    lib = load_lib(*export, sentence_examples.RANK_WEIGHTED)
+    words = query_words(vocabulary)
+    found = lib.find_example_sentences_by_words(words + words[:10], 3)
+    assert list(found) == words
+    for word in words:
+        assert ids(found[word]) == ids(lib.find_example_sentences_by_word_scan(word, 3)), word